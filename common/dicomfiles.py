@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions shared by organize_dicom.py, dev/organize_dicom_cmd,
+dev/dicom_index and dev/process_gammex: checking whether files are DICOM,
+walking folder trees with parallel listing and summarizing series geometry
+
+Each tool adds this folder to sys.path and imports what it needs, so the tools
+use one implementation instead of keeping copies in step.
+
+"""
+import os
+import time
+import statistics
+import contextlib
+import pydicom
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# first two bytes of a dicom file without preamble, group 0002 or 0008 tag
+# in little or big endian byte order
+no_preamble_starts = [b"\x02\x00", b"\x08\x00", b"\x00\x02", b"\x00\x08"]
+
+# file in each series folder describing the slice positions of the series
+summary_name = "series_summary.json"
+
+# errors raised by pydicom for files that look like dicom but cannot be read
+# (truncated, corrupt or unreadable files), counted with their reason by callers
+read_errors = (
+    pydicom.errors.InvalidDicomError,
+    pydicom.errors.BytesLengthException,
+    OSError,
+    EOFError,
+    ValueError,
+)
+
+
+def sniff_header(name: str, head: bytes, allow_no_preamble: bool = False):
+    """
+    Check whether a file is DICOM from its name and first 132 bytes.
+    DICOM files have a 128 byte preamble followed by the b"DICM" prefix. Files
+    written without preamble start directly with a group 0002 or 0008 element,
+    these are only accepted when allow_no_preamble is True.
+
+    Parameters
+    ----------
+    name : file name or path
+    head : first 132 bytes of the file (fewer for short files)
+    allow_no_preamble : accept files starting with a group 0002 or 0008 tag
+
+    Returns
+    -------
+    None if the file looks like DICOM, otherwise the reason it was rejected:
+    "DICOMDIR", "empty file" or "no DICM prefix"
+    """
+    if os.path.basename(name).upper() == "DICOMDIR":
+        return "DICOMDIR"
+    if head[128:132] == b"DICM":
+        return None
+    if len(head) == 0:
+        return "empty file"
+    if allow_no_preamble and head[:2] in no_preamble_starts:
+        return None
+    return "no DICM prefix"
+
+
+def sniff_dicom(path: str, allow_no_preamble: bool = False):
+    """
+    Cheap check of whether a file is DICOM using only its first 132 bytes, so
+    non-DICOM files (pdf, xlsx, logs...) are rejected without a pydicom parse
+    attempt, see sniff_header()
+    """
+    with open(path, "rb") as fp:
+        head = fp.read(132)
+    return sniff_header(path, head, allow_no_preamble)
+
+
+@contextlib.contextmanager
+def timed(metrics: dict, stage: str):
+    """
+    Add the time spent in the with block to metrics["seconds"][stage],
+    does nothing if metrics is None
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            elapsed = time.perf_counter() - start
+            with metrics["lock"]:
+                metrics["seconds"][stage] += elapsed
+
+
+def list_dir(path: str):
+    """
+    List one folder with os.scandir
+
+    Returns
+    -------
+    (files, dirs) : lists of file paths and subfolder paths, both empty if the
+    folder could not be read
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry.path)
+    except OSError as e:
+        print(f"could not list folder {path}: {e}")
+    return files, dirs
+
+
+def walk_files(roots: list, workers: int = 8, metrics: dict = None):
+    """
+    Yield the paths of all files under the roots folders as they are found.
+    Folders are listed with os.scandir in a thread pool so several listings
+    are in flight at once, which hides the latency of network shares. Only
+    folders still waiting to be listed are kept in memory, files are handed
+    on as soon as their folder has been read.
+
+    Parameters
+    ----------
+    roots : list of folders to walk
+    workers : number of folders listed in parallel
+    metrics : optional metrics from new_metrics(), listing time is added
+
+    Yields
+    ------
+    file path
+    """
+
+    def listing(path):
+        with timed(metrics, "listing"):
+            return list_dir(path)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque(pool.submit(listing, root) for root in roots)
+        while pending:
+            files, dirs = pending.popleft().result()
+            for path in sorted(dirs):
+                pending.append(pool.submit(listing, path))
+            yield from sorted(files)
+
+
+def bounded_map(func, items, workers: int = 1):
+    """
+    Like ThreadPoolExecutor.map but only keeps 2 x workers items in flight, so
+    items can be a generator (i.e. walk_files()) that is consumed while earlier
+    items are still being processed. Results are yielded in order as
+    (item, result) pairs.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(func, item)))
+            if len(pending) >= 2 * workers:
+                done, future = pending.popleft()
+                yield done, future.result()
+        while pending:
+            done, future = pending.popleft()
+            yield done, future.result()
+
+
+def series_summary(slices: list):
+    """
+    Check the completeness of a series from the slice geometry of its
+    instances, without reading any pixel data. slices are dicts with
+    "location", "position" and "thickness" (slice_info() of organizefunctions.py,
+    record_slice() of ctfunctions.py), so the organizers and separators write
+    the same series_summary.json.
+    Positions are SliceLocation, or the z of ImagePositionPatient for
+    instances without one. A gap is a step between neighbouring positions
+    of more than 1.5 x the typical (median) slice spacing.
+
+    Returns
+    -------
+    {"instances": int, "locations": [sorted positions], "spacing": float,
+    "extent": float, "gaps": [[position, next position]], "duplicate_locations":
+    [positions], "slice_thicknesses": [distinct values], "no_location": int,
+    "complete": bool, "problems": [str]}
+    """
+    locations = []
+    no_location = 0
+    thicknesses = set()
+    for info in slices:
+        info = info or {}
+        location = info.get("location")
+        if location is None and info.get("position"):
+            location = info["position"][2]
+        if location is None:
+            no_location += 1
+        else:
+            locations.append(round(location, 3))
+        if info.get("thickness") is not None:
+            thicknesses.add(info["thickness"])
+    locations.sort()
+    steps = [b - a for a, b in zip(locations, locations[1:])]
+    spacing = statistics.median([x for x in steps if x > 0.01] or [0])
+    gaps = [
+        [a, b]
+        for a, b in zip(locations, locations[1:])
+        if spacing > 0 and b - a > 1.5 * spacing
+    ]
+    duplicates = sorted(
+        {b for a, b in zip(locations, locations[1:]) if abs(b - a) <= 0.01}
+    )
+    problems = []
+    if len(gaps) > 0:
+        problems.append(f"{len(gaps)} gaps in slice positions")
+    if len(duplicates) > 0:
+        problems.append(f"{len(duplicates)} duplicated slice positions")
+    if len(thicknesses) > 1:
+        problems.append(f"inconsistent SliceThickness {sorted(thicknesses)}")
+    if no_location > 0:
+        problems.append(f"{no_location} instances without slice position")
+    return {
+        "instances": len(slices),
+        "locations": locations,
+        "spacing": spacing,
+        "extent": round(locations[-1] - locations[0], 3) if locations else 0,
+        "gaps": gaps,
+        "duplicate_locations": duplicates,
+        "slice_thicknesses": sorted(thicknesses),
+        "no_location": no_location,
+        "complete": len(problems) == 0,
+        "problems": problems,
+    }
@@ -0,0 +1,69 @@
+import os
+import sys
+from datetime import datetime
+import tkinter
+from tkinter import filedialog
+
+# add path for importing comparefunctions.py
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import comparefunctions
+
+# do not load Pixel Data and binary elements larger than 64 KB (OB/OW/UN...),
+# compare them by length and sha256 instead so only the headers are kept in memory
+header_only = True
+
+root = tkinter.Tk()
+root.wm_attributes("-topmost", 1)
+root.withdraw()  # hide tkinter root window
+message = ""
+
+# ask for series folders until the dialog is cancelled
+folders = []
+currdir = os.getcwd()
+while True:
+    tempdir = filedialog.askdirectory(
+        parent=root,
+        initialdir=currdir,
+        title=f"Select series folder {len(folders) + 1} (cancel when done)",
+    )
+    if len(tempdir) == 0:
+        break
+    folders.append(os.path.abspath(tempdir))
+    currdir = os.path.dirname(folders[-1])
+
+try:
+    if len(folders) < 2:
+        message = "Invalid Number of Folders: Please select at least 2 series folders for comparison..."
+        tkinter.messagebox.showerror(title="Error", message=message)
+
+    if len(folders) > 1:
+        destpath = os.path.dirname(folders[0])
+        df = comparefunctions.compare_series(folders, header_only)
+
+        # generate timestamp for filename
+        now = datetime.now()
+        timestamp = now.strftime("%m%d%y_%H%M%S")
+
+        htmlpath, csvpath = comparefunctions.write_comparison(
+            df, destpath, timestamp, "compared_series"
+        )
+        differs = (df["status"] == "differs between series").sum()
+        varies = (df["status"] == "varies per instance").sum()
+        message = f"{differs} tags differ between series, {varies} vary per instance\n"
+        unreadable = df.loc[df["desc"] == "Unreadable"].iloc[0, 3:]
+        for folder, files in zip(folders, unreadable):
+            if files:
+                message = message + f"could not read in {folder}: {files}\n"
+        message = message + "finished processing, added files: \n"
+        message = message + f"{htmlpath} \n"
+        message = message + f"{csvpath}"
+        tkinter.messagebox.showinfo(title="Finished", message=message)
+        # Open file location , this command only works in windows.
+        os.startfile(destpath)
+
+except ValueError as e:
+    # i.e. a folder without readable dicom instances
+    tkinter.messagebox.showerror(title="Error", message=str(e))
+except:
+    message = "something went wrong..."
+    tkinter.messagebox.showerror(title="Error", message=message)
@@ -0,0 +1,928 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for compare_dicom.py
+
+Compares the headers of any number of dicom datasets. Each dataset is walked
+once into a table keyed by tag, and the comparison is built one column per
+dataset from those tables, so the cost grows with the number of elements
+instead of with the number of elements squared.
+
+"""
+import os
+import hashlib
+import contextlib
+import numpy as np
+import pydicom
+import pandas as pd
+from pydicom.dataelem import RawDataElement
+from concurrent.futures import ThreadPoolExecutor
+
+# value shown for datasets that do not contain a tag
+not_present = "tag_not_present"
+
+# binary elements larger than binary_size bytes are compared by length and hash
+binary_vrs = ["OB", "OD", "OF", "OL", "OV", "OW", "UN"]
+binary_size = 64 * 1024
+
+pixel_tags = {
+    0x7FE00008: "Float Pixel Data",
+    0x7FE00009: "Double Float Pixel Data",
+    0x7FE00010: "Pixel Data",
+}
+
+
+def binary_value(length: int, digest: str):
+    """
+    Value shown for a binary element compared by length and hash
+    """
+    return f"{length} bytes, sha256 {digest}"
+
+
+def hash_file_range(fp, offset: int, length: int = None):
+    """
+    sha256 of length bytes of fp starting at offset (to the end of the file when
+    length is None), read in 1 MB chunks
+
+    Returns
+    -------
+    (bytes hashed, hexdigest)
+    """
+    fp.seek(offset)
+    digest = hashlib.sha256()
+    remaining = length
+    total = 0
+    while remaining is None or remaining > 0:
+        size = 1024 * 1024 if remaining is None else min(remaining, 1024 * 1024)
+        chunk = fp.read(size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        total += len(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+    return total, digest.hexdigest()
+
+
+def tag_description(tag):
+    """
+    Dictionary description of a tag without converting its element
+    """
+    try:
+        return pydicom.datadict.dictionary_description(tag)
+    except KeyError:
+        return "Private tag data" if tag.is_private else ""
+
+
+def is_deferred(raw):
+    """
+    True for binary elements left unread by dcmread(defer_size=...)
+    """
+    if not isinstance(raw, RawDataElement) or raw.value is not None or raw.length == 0:
+        return False
+    vr = raw.VR
+    if vr is None:
+        try:
+            vr = pydicom.datadict.dictionary_VR(raw.tag)
+        except KeyError:
+            vr = "UN"
+    return vr in binary_vrs
+
+
+def sequence_items(ds, tag, fp=None):
+    """
+    Items of a sequence element, or None when the element is not a sequence
+    """
+    if fp is not None and is_deferred(ds.get_item(tag)):
+        return None
+    elem = ds[tag]
+    return elem.value if elem.VR == "SQ" else None
+
+
+def element_entry(ds, tag, binary_size: int = None, fp=None):
+    """
+    Description and compared value of a (not sequence) element, see tag_table()
+
+    Returns
+    -------
+    {"desc": description, "value": value}
+    """
+    raw = ds.get_item(tag)
+    if fp is not None and is_deferred(raw):
+        return {
+            "desc": tag_description(tag),
+            "value": binary_value(*hash_file_range(fp, raw.value_tell, raw.length)),
+        }
+    elem = ds[tag]
+    if (
+        binary_size is not None
+        and elem.VR in binary_vrs
+        and isinstance(elem.value, bytes)
+        and len(elem.value) > binary_size
+    ):
+        value = binary_value(len(elem.value), hashlib.sha256(elem.value).hexdigest())
+    else:
+        repval = elem.repval
+        value = repval if "Array" in repval else elem.value
+    return {"desc": elem.description(), "value": value}
+
+
+def tag_table(ds, binary_size: int = None, fp=None):
+    """
+    Walk a dataset (including sequence items) once and index its elements by tag
+
+    Parameters
+    ----------
+    ds : pydicom Dataset
+    binary_size : compare binary elements (OB/OW/UN...) larger than binary_size
+        bytes by length and hash instead of by value
+    fp : open file ds was read from with defer_size, deferred binary elements
+        are hashed from the file in chunks without loading them
+
+    Returns
+    -------
+    dict of tag json_key: {"desc": description, "value": value}. Elements with a
+    repval containing "Array" (Pixel Data and other binary elements) keep their
+    repval as value. Sequences are flattened, a tag found in more than one
+    sequence item keeps its first value (see compare_tree() for comparing
+    sequence items).
+    """
+    table = {}
+
+    def recurse(ds):
+        for tag in ds.keys():
+            items = sequence_items(ds, tag, fp)
+            if items is not None:
+                for item in items:
+                    recurse(item)
+            elif tag.json_key not in table:
+                table[tag.json_key] = element_entry(ds, tag, binary_size, fp)
+
+    recurse(ds)
+    return table
+
+
+def pixel_element(fp, ds, start: int):
+    """
+    Locate the pixel data element at start, the position fp was left at after
+    reading ds with stop_before_pixels
+
+    Returns
+    -------
+    (tag, value offset, value length), length is None for encapsulated (undefined
+    length) pixel data, or None when the file has no pixel data
+    """
+    fp.seek(start)
+    header = fp.read(8)
+    if len(header) < 8:
+        return None
+    order = "little" if ds.is_little_endian else "big"
+    group = int.from_bytes(header[0:2], order)
+    element = int.from_bytes(header[2:4], order)
+    tag = pydicom.tag.Tag(group, element)
+    if tag not in pixel_tags:
+        return None
+    if ds.is_implicit_VR:
+        length = int.from_bytes(header[4:8], order)
+        offset = start + 8
+    else:
+        length = int.from_bytes(fp.read(4), order)
+        offset = start + 12
+    if length == 0xFFFFFFFF:
+        length = None
+    return tag, offset, length
+
+
+def encapsulated_end(fp, ds, offset: int):
+    """
+    Position just after the sequence delimiter of encapsulated pixel data whose
+    first item starts at offset, found by skipping from item header to item
+    header without reading the fragments
+    """
+    order = "little" if ds.is_little_endian else "big"
+    position = offset
+    while True:
+        fp.seek(position)
+        header = fp.read(8)
+        if len(header) < 8:
+            return position
+        group = int.from_bytes(header[0:2], order)
+        element = int.from_bytes(header[2:4], order)
+        position += 8
+        if (group, element) == (0xFFFE, 0xE0DD):
+            return position
+        position += int.from_bytes(header[4:8], order)
+
+
+def read_after_pixels(fp, ds, start: int, binary_size: int = binary_size):
+    """
+    Add the elements stored after the pixel data element (i.e. (FFFC,FFFC) Data
+    Set Trailing Padding) to ds read with stop_before_pixels, so header only
+    comparisons show the same tags as full reads. Binary elements larger than
+    binary_size bytes are left deferred, see is_deferred().
+    """
+    element = pixel_element(fp, ds, start)
+    if element is None:
+        return
+    tag, offset, length = element
+    if length is None:
+        fp.seek(encapsulated_end(fp, ds, offset))
+    else:
+        fp.seek(offset + length)
+    trailing = pydicom.filereader.read_dataset(
+        fp, ds.is_implicit_VR, ds.is_little_endian, defer_size=binary_size
+    )
+    for tag in trailing.keys():
+        ds[tag] = trailing.get_item(tag)
+
+
+def pixel_entry(fp, ds, start: int):
+    """
+    Length and hash of the pixel data element at start, see pixel_element().
+    Encapsulated pixel data is hashed up to and including its sequence delimiter.
+
+    Returns
+    -------
+    (tag json_key, {"desc": description, "value": length and hash}), or None
+    when the file has no pixel data
+    """
+    element = pixel_element(fp, ds, start)
+    if element is None:
+        return None
+    tag, offset, length = element
+    if length is None:
+        length = encapsulated_end(fp, ds, offset) - offset
+    return tag.json_key, {
+        "desc": pixel_tags[tag],
+        "value": binary_value(*hash_file_range(fp, offset, length)),
+    }
+
+
+def header_table(path: str, binary_size: int = binary_size):
+    """
+    Tag table of a dicom file read without loading Pixel Data or binary elements
+    larger than binary_size bytes, those are compared by length and a sha256
+    streamed from the file, so memory tracks the header size only. Elements
+    after the pixel data are included, see read_after_pixels().
+
+    Parameters
+    ----------
+    path : path to a dicom file
+    binary_size : size in bytes above which binary elements are not loaded
+
+    Returns
+    -------
+    dict, see tag_table()
+    """
+    with open(path, "rb") as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True, defer_size=binary_size)
+        start = fp.tell()
+        read_after_pixels(fp, ds, start, binary_size)
+        table = tag_table(ds, binary_size, fp)
+        pixels = pixel_entry(fp, ds, start)
+    if pixels is not None:
+        table[pixels[0]] = pixels[1]
+    return table
+
+
+def compare_tables(tables: list, names: list):
+    """
+    Build the comparison of any number of tag tables
+
+    Parameters
+    ----------
+    tables : list of tag tables from tag_table()
+    names : list of names (i.e. file names) shown in the first row, one per table
+
+    Returns
+    -------
+    pandas DataFrame with columns _tag, desc, value1 ... valueN and z_same, one row
+    per tag found in any of the tables sorted by tag, after a "Filename" row
+    """
+    tags = sorted(set().union(*tables))
+    descs = {}
+    for table in reversed(tables):
+        descs.update({x: y["desc"] for x, y in table.items()})
+    columns = {"_tag": ["0", *tags], "desc": ["Filename", *(descs[x] for x in tags)]}
+    same = [True] * len(tags)
+    first = None
+    for count, (table, name) in enumerate(zip(tables, names)):
+        values = [table[x]["value"] if x in table else not_present for x in tags]
+        if first is None:
+            first = values
+        else:
+            same = [s and x == y for s, x, y in zip(same, values, first)]
+        columns[f"value{count + 1}"] = [name, *values]
+    columns["z_same"] = ["", *(str(x) for x in same)]
+    return pd.DataFrame(columns)
+
+
+def compare_datasets(datasets: list, names: list = None):
+    """
+    Compare the headers of any number of pydicom datasets
+
+    Parameters
+    ----------
+    datasets : list of pydicom Datasets
+    names : names shown in the first row, defaults to dataset1 ... datasetN
+
+    Returns
+    -------
+    pandas DataFrame, see compare_tables()
+    """
+    if names is None:
+        names = [f"dataset{x + 1}" for x in range(len(datasets))]
+    return compare_tables([tag_table(x) for x in datasets], names)
+
+
+def compare_files(paths: list, header_only: bool = False):
+    """
+    Read and compare the headers of any number of dicom files. Files are read
+    one at a time and only their tag tables are kept in memory.
+
+    Parameters
+    ----------
+    paths : list of paths to dicom files
+    header_only : do not load Pixel Data and large binary elements, compare them
+        by length and hash instead (see header_table())
+
+    Returns
+    -------
+    pandas DataFrame, see compare_tables()
+    """
+    if header_only:
+        tables = [header_table(x) for x in paths]
+    else:
+        tables = [tag_table(pydicom.dcmread(x)) for x in paths]
+    return compare_tables(tables, [os.path.basename(x) for x in paths])
+
+
+def item_hash(ds, hashes: dict):
+    """
+    Content hash of a sequence item. Elements not yet converted by pydicom are
+    hashed from their raw bytes, nested items through their own hash, so an item
+    is hashed without decoding its elements. Hashes are kept in hashes (by item
+    id) so every item is hashed once.
+    """
+    key = id(ds)
+    if key in hashes:
+        return hashes[key]
+    digest = hashlib.sha256()
+    for tag in ds.keys():
+        elem = ds.get_item(tag)
+        digest.update(int(tag).to_bytes(4, "little"))
+        if isinstance(elem, RawDataElement):
+            digest.update(
+                f"{elem.VR}{elem.is_implicit_VR}{elem.is_little_endian}".encode()
+            )
+            digest.update(elem.length.to_bytes(4, "little"))
+            digest.update(elem.value or b"")
+        elif elem.VR == "SQ":
+            digest.update(b"SQ")
+            for item in elem.value:
+                digest.update(item_hash(item, hashes).encode())
+        else:
+            digest.update(f"{elem.VR}{elem.value!r}".encode())
+    hashes[key] = digest.hexdigest()
+    return hashes[key]
+
+
+def tree_rows(datasets: list, prefix: str, rows: list, hashes: dict, binary_size, fps):
+    """
+    Compare the elements of datasets (None where a dataset does not have this
+    sequence item) one level at a time and add a row per element to rows. Path
+    keys name the sequence and item of nested elements (i.e.
+    00540016[0].00181072). Sequence items with the same content hash in every
+    dataset are skipped without comparing their elements, items that differ are
+    compared element by element.
+    """
+    tags = sorted(set().union(*(x.keys() for x in datasets if x is not None)))
+    for tag in tags:
+        path = f"{prefix}{tag.json_key}"
+        present = [x is not None and tag in x for x in datasets]
+        sequences = [
+            sequence_items(x, tag, fp) if found else None
+            for x, fp, found in zip(datasets, fps, present)
+        ]
+        if any(x is not None for x in sequences):
+            lengths = [len(x) if x is not None else 0 for x in sequences]
+            item_rows = []
+            identical = True
+            for index in range(max(lengths)):
+                items = [
+                    x[index] if x is not None and index < len(x) else None
+                    for x in sequences
+                ]
+                if (
+                    None not in items
+                    and len({item_hash(x, hashes) for x in items}) == 1
+                ):
+                    continue
+                identical = False
+                tree_rows(
+                    items, f"{path}[{index}].", item_rows, hashes, binary_size, fps
+                )
+            values = [
+                f"{len(x)} items" if x is not None else not_present for x in sequences
+            ]
+            rows.append(
+                {
+                    "_tag": path,
+                    "desc": tag_description(tag),
+                    "values": values,
+                    "same": identical and len(set(values)) == 1,
+                }
+            )
+            rows.extend(item_rows)
+            continue
+        values = []
+        desc = None
+        for ds, fp, found in zip(datasets, fps, present):
+            if not found:
+                values.append(not_present)
+                continue
+            entry = element_entry(ds, tag, binary_size, fp)
+            desc = desc or entry["desc"]
+            values.append(entry["value"])
+        same = all(x == values[0] for x in values[1:])
+        rows.append({"_tag": path, "desc": desc, "values": values, "same": same})
+
+
+def compare_tree(paths: list, header_only: bool = True):
+    """
+    Compare the headers of any number of dicom files as trees. Unlike
+    compare_files(), which flattens sequences, every element is keyed by its path
+    (i.e. 00540016[0].00181072 for the first item of a sequence), so repeated
+    tags in different sequence items are all compared. Sequence items identical
+    in all files (same content hash) are skipped, so enhanced multi-frame objects
+    with thousands of per-frame functional group items only show the items and
+    elements that differ.
+
+    Parameters
+    ----------
+    paths : list of paths to dicom files
+    header_only : see compare_files()
+
+    Returns
+    -------
+    pandas DataFrame with columns _tag (path), desc, value1 ... valueN and z_same,
+    sequences show their number of items, in tag order with the differing items
+    of a sequence after it
+    """
+    with contextlib.ExitStack() as stack:
+        fps = [stack.enter_context(open(x, "rb")) for x in paths]
+        if header_only:
+            datasets = [
+                pydicom.dcmread(x, stop_before_pixels=True, defer_size=binary_size)
+                for x in fps
+            ]
+            starts = [x.tell() for x in fps]
+            for fp, ds, start in zip(fps, datasets, starts):
+                read_after_pixels(fp, ds, start)
+        else:
+            datasets = [pydicom.dcmread(x) for x in fps]
+        rows = []
+        size = binary_size if header_only else None
+        deferred = fps if header_only else [None] * len(fps)
+        tree_rows(datasets, "", rows, {}, size, deferred)
+        if header_only:
+            pixels = [pixel_entry(*x) for x in zip(fps, datasets, starts)]
+            found = [x for x in pixels if x is not None]
+            if found:
+                values = [x[1]["value"] if x else not_present for x in pixels]
+                same = all(x == values[0] for x in values[1:])
+                tag, entry = found[0]
+                row = {
+                    "_tag": tag,
+                    "desc": entry["desc"],
+                    "values": values,
+                    "same": same,
+                }
+                # before the elements stored after the pixel data
+                index = next((i for i, x in enumerate(rows) if x["_tag"] > tag), None)
+                rows.insert(len(rows) if index is None else index, row)
+    columns = {
+        "_tag": ["0", *(x["_tag"] for x in rows)],
+        "desc": ["Filename", *(x["desc"] for x in rows)],
+    }
+    for count, path in enumerate(paths):
+        columns[f"value{count + 1}"] = [
+            os.path.basename(path),
+            *(x["values"][count] for x in rows),
+        ]
+    columns["z_same"] = ["", *(str(x["same"]) for x in rows)]
+    return pd.DataFrame(columns)
+
+
+def read_series(folder: str, header_only: bool = True, workers: int = 4):
+    """
+    Read the headers of every dicom instance in a series folder into a column
+    table, files that are not dicom are skipped and dicom files that cannot be
+    read (i.e. truncated) are listed with the error
+
+    Parameters
+    ----------
+    folder : series folder
+    header_only : see compare_files()
+    workers : number of threads reading headers
+
+    Returns
+    -------
+    (table, descs, unreadable), table is a pandas DataFrame with one row per
+    instance, a "file" column and one column per tag holding the value as a
+    string (tag_not_present where an instance does not have the tag), descs is
+    a dict of tag: description, unreadable is a dict of file name: exception
+    type for files that could not be read
+    """
+    paths = sorted(x.path for x in os.scandir(folder) if x.is_file())
+
+    def read(path):
+        try:
+            if header_only:
+                return path, header_table(path)
+            return path, tag_table(pydicom.dcmread(path))
+        except pydicom.errors.InvalidDicomError:
+            return path, None
+        except Exception as e:
+            return path, type(e).__name__
+
+    rows = []
+    descs = {}
+    unreadable = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for path, table in pool.map(read, paths):
+            if table is None:
+                continue
+            if isinstance(table, str):
+                unreadable[os.path.basename(path)] = table
+                continue
+            row = {x: str(y["value"]) for x, y in table.items()}
+            row["file"] = os.path.basename(path)
+            rows.append(row)
+            descs.update({x: y["desc"] for x, y in table.items() if x not in descs})
+    table = pd.DataFrame(rows).fillna(not_present)
+    return table, descs, unreadable
+
+
+def compare_series(folders: list, header_only: bool = True, workers: int = 4):
+    """
+    Compare the headers of two or more series. Every instance header is
+    flattened into one column table and each tag is classified as
+
+    - "same": one value in all instances of all series
+    - "varies per instance": more than one value within a series
+      (i.e. SliceLocation, InstanceNumber, SOPInstanceUID)
+    - "differs between series": constant within each series, but not the same
+      value in every series (missing in a series counts as a value)
+
+    Parameters
+    ----------
+    folders : list of series folders
+    header_only : see compare_files()
+    workers : number of threads reading headers
+
+    Returns
+    -------
+    pandas DataFrame with columns _tag, desc, status and series1 ... seriesN, one
+    row per tag after a "Folder", an "Instances" and an "Unreadable" row (files
+    that could not be read and why). Series columns show the value of constant
+    tags and the number (and range) of values of varying tags.
+
+    Raises
+    ------
+    ValueError if a folder has no readable dicom instance
+    """
+    tables = []
+    descs = {}
+    unreadable = []
+    for count, folder in enumerate(folders):
+        table, folder_descs, folder_unreadable = read_series(
+            folder, header_only, workers
+        )
+        if len(table) == 0:
+            raise ValueError(
+                f"no readable dicom instances in {folder}, "
+                f"{len(folder_unreadable)} dicom files could not be read"
+            )
+        unreadable.append(folder_unreadable)
+        table["series"] = count
+        tables.append(table)
+        for x, y in folder_descs.items():
+            descs.setdefault(x, y)
+    table = pd.concat(tables, ignore_index=True).fillna(not_present)
+    tags = sorted(descs)
+    grouped = table.groupby("series")[tags]
+    counts = grouped.nunique()
+    firsts = grouped.first()
+    varies = (counts > 1).any()
+    differs = ~varies & (firsts.nunique() > 1)
+    status = pd.Series("same", index=tags)
+    status[varies] = "varies per instance"
+    status[differs] = "differs between series"
+
+    columns = {
+        "_tag": ["0", "0", "0", *tags],
+        "desc": ["Folder", "Instances", "Unreadable", *(descs[x] for x in tags)],
+        "status": ["", "", "", *status],
+    }
+    # "N values, min .. max" for varying tags, the range only if all are numeric
+    varying = list(status.index[varies])
+    numbers = table[varying].apply(pd.to_numeric, errors="coerce")
+    grouped = numbers.groupby(table["series"])
+    numeric = numbers.notna().groupby(table["series"]).all()
+    mins = grouped.min()
+    maxs = grouped.max()
+    sizes = table.groupby("series").size()
+    for count, folder in enumerate(folders):
+        values = firsts.loc[count].copy()
+        for tag in varying:
+            values[tag] = f"{counts.at[count, tag]} values"
+            if numeric.at[count, tag]:
+                values[tag] += f", {mins.at[count, tag]:g} .. {maxs.at[count, tag]:g}"
+        failed = "; ".join(f"{x} ({y})" for x, y in unreadable[count].items())
+        columns[f"series{count + 1}"] = [folder, sizes[count], failed, *values]
+    return pd.DataFrame(columns)
+
+
+def rescale_values(ds, frames: int):
+    """
+    RescaleSlope and RescaleIntercept of each frame, from the top level header or
+    the shared or per-frame functional groups of enhanced objects
+
+    Returns
+    -------
+    list of (slope, intercept), one per frame
+    """
+    default = (
+        float(ds.get("RescaleSlope", 1) or 1),
+        float(ds.get("RescaleIntercept", 0) or 0),
+    )
+    shared = ds.get("SharedFunctionalGroupsSequence")
+    if shared and "PixelValueTransformationSequence" in shared[0]:
+        item = shared[0].PixelValueTransformationSequence[0]
+        default = (float(item.RescaleSlope), float(item.RescaleIntercept))
+    values = [default] * frames
+    per_frame = ds.get("PerFrameFunctionalGroupsSequence") or []
+    for count, frame in enumerate(per_frame[:frames]):
+        if "PixelValueTransformationSequence" in frame:
+            item = frame.PixelValueTransformationSequence[0]
+            values[count] = (float(item.RescaleSlope), float(item.RescaleIntercept))
+    return values
+
+
+def encapsulated_frames(path: str, ds, offset: int, frames: int):
+    """
+    Encoded frames of encapsulated pixel data, read from the file one frame's
+    fragments at a time. Fragments are grouped into frames with the Basic or
+    Extended Offset Table, without either a single frame gets all fragments and
+    multiple frames one fragment each (as in pydicom).
+
+    Parameters
+    ----------
+    path : path to a dicom file
+    ds : header of path read with stop_before_pixels
+    offset : value offset of the pixel data element, see pixel_element()
+    frames : number of frames
+
+    Returns
+    -------
+    generator of lists of fragments (bytes), one list per frame
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        fp = pydicom.filebase.DicomFileLike(f)
+        fp.is_little_endian = True
+        has_offsets, offsets = pydicom.encaps.get_frame_offsets(fp)
+        if not has_offsets and "ExtendedOffsetTable" in ds:
+            offsets = np.frombuffer(ds.ExtendedOffsetTable, "<u8").tolist()
+            has_offsets = True
+        starts = set(offsets[1:]) if has_offsets else set()
+        count = 0
+        position = 0
+        fragments = []
+        for fragment in pydicom.encaps.generate_pixel_data_fragment(fp):
+            if fragments and (position in starts or (not has_offsets and frames > 1)):
+                yield fragments
+                count += 1
+                fragments = []
+            fragments.append(fragment)
+            position += 8 + len(fragment)
+        if fragments:
+            yield fragments
+            count += 1
+    if count != frames:
+        raise ValueError(f"found {count} of {frames} frames in {path}")
+
+
+def iter_encapsulated(path: str, ds, offset: int, frames: int):
+    """
+    Decode encapsulated pixel data one frame at a time: every frame from
+    encapsulated_frames() is decoded by pydicom as a single frame dataset, so
+    only one compressed and one decoded frame are held in memory
+
+    Returns
+    -------
+    generator of numpy arrays (Rows, Columns[, Samples])
+    """
+    single = pydicom.Dataset(ds)
+    single.file_meta = ds.file_meta
+    single.is_little_endian = ds.is_little_endian
+    single.is_implicit_VR = ds.is_implicit_VR
+    for tag in (0x7FE00001, 0x7FE00002):
+        if tag in single:
+            del single[tag]
+    if "NumberOfFrames" in single:
+        single.NumberOfFrames = 1
+    # empty Basic Offset Table item followed by the frame's fragments
+    empty_table = b"\xfe\xff\x00\xe0\x00\x00\x00\x00"
+    for fragments in encapsulated_frames(path, ds, offset, frames):
+        single.PixelData = empty_table + b"".join(
+            pydicom.encaps.itemize_fragment(fragment) for fragment in fragments
+        )
+        single["PixelData"].VR = "OB"
+        single["PixelData"].is_undefined_length = True
+        yield single.pixel_array
+
+
+def iter_frames(path: str):
+    """
+    Stored pixel values of a dicom file, one frame at a time. Uncompressed pixel
+    data is read from the file frame by frame, compressed (encapsulated) pixel
+    data is read one frame's fragments at a time and each frame is decoded with
+    pydicom on its own, see iter_encapsulated(). Only uncompressed bit packed,
+    planar or signed pixels with BitsStored < BitsAllocated are decoded with
+    pydicom as a whole object and then returned frame by frame.
+
+    Parameters
+    ----------
+    path : path to a dicom file
+
+    Returns
+    -------
+    (ds, frames, generator of numpy arrays (Rows, Columns[, Samples])), ds is the
+    header read without pixel data
+    """
+    with open(path, "rb") as fp:
+        ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        element = pixel_element(fp, ds, fp.tell())
+    if element is None:
+        raise ValueError(f"no pixel data in {path}")
+    frames = int(ds.get("NumberOfFrames", 1) or 1)
+    samples = int(ds.get("SamplesPerPixel", 1))
+    bits = int(ds.BitsAllocated)
+    signed = int(ds.get("PixelRepresentation", 0)) == 1
+    shape = (int(ds.Rows), int(ds.Columns)) + ((samples,) if samples > 1 else ())
+    planar = samples > 1 and int(ds.get("PlanarConfiguration", 0)) == 1
+    tag, offset, length = element
+    if tag == 0x7FE00010:
+        dtype = np.dtype(f"{'i' if signed else 'u'}{bits // 8}")
+    else:
+        dtype = np.dtype(f"f{bits // 8}")
+    dtype = dtype.newbyteorder("<" if ds.is_little_endian else ">")
+    frame_bytes = int(np.prod(shape)) * dtype.itemsize
+    stream = (
+        length is not None
+        and bits in (8, 16, 32, 64)
+        and not planar
+        and not (signed and int(ds.BitsStored) < bits)
+        and length >= frame_bytes * frames
+    )
+
+    def read_stream():
+        with open(path, "rb") as fp:
+            for count in range(frames):
+                fp.seek(offset + count * frame_bytes)
+                data = fp.read(frame_bytes)
+                yield np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def read_decoded():
+        if length is None:
+            yield from iter_encapsulated(path, ds, offset, frames)
+            return
+        pixels = pydicom.dcmread(path).pixel_array
+        if frames == 1:
+            pixels = pixels[np.newaxis]
+        for frame in pixels:
+            yield frame
+
+    return ds, frames, read_stream() if stream else read_decoded()
+
+
+def compare_pixels(path1: str, path2: str, rescale: bool = True, diff_path: str = None):
+    """
+    Compare the pixel data of two dicom files frame by frame, only one frame of
+    each file is held in memory at a time
+
+    Parameters
+    ----------
+    path1, path2 : paths to dicom files
+    rescale : compare rescaled values (i.e. HU, using RescaleSlope and
+        RescaleIntercept of each frame) instead of stored values
+    diff_path : optional .npy file for the difference image (path2 - path1) as
+        float32 with shape (frames, Rows, Columns[, Samples]), written frame by
+        frame through a memory map
+
+    Returns
+    -------
+    dict with frames, pixels, equal (stored values identical), hash1 and hash2
+    (sha256 of the stored values, independent of transfer syntax),
+    differing_pixels, max_abs_diff and mean_abs_diff
+    """
+    ds1, frames1, pixels1 = iter_frames(path1)
+    ds2, frames2, pixels2 = iter_frames(path2)
+    shape1 = (frames1, int(ds1.Rows), int(ds1.Columns))
+    shape2 = (frames2, int(ds2.Rows), int(ds2.Columns))
+    if shape1 != shape2:
+        raise ValueError(f"pixel data shapes differ: {shape1} and {shape2}")
+    rescale1 = rescale_values(ds1, frames1)
+    rescale2 = rescale_values(ds2, frames2)
+    hash1 = hashlib.sha256()
+    hash2 = hashlib.sha256()
+    diff_image = None
+    differing = 0
+    max_diff = 0.0
+    total_diff = 0.0
+    pixels = 0
+    for count, (frame1, frame2) in enumerate(zip(pixels1, pixels2)):
+        if frame1.shape != frame2.shape:
+            raise ValueError(f"frame shapes differ: {frame1.shape} and {frame2.shape}")
+        hash1.update(np.ascontiguousarray(frame1, frame1.dtype.newbyteorder("<")))
+        hash2.update(np.ascontiguousarray(frame2, frame2.dtype.newbyteorder("<")))
+        values1 = frame1.astype(np.float64)
+        values2 = frame2.astype(np.float64)
+        if rescale:
+            values1 = values1 * rescale1[count][0] + rescale1[count][1]
+            values2 = values2 * rescale2[count][0] + rescale2[count][1]
+        diff = values2 - values1
+        if diff_path is not None:
+            if diff_image is None:
+                diff_image = np.lib.format.open_memmap(
+                    diff_path, mode="w+", dtype=np.float32, shape=(frames1, *diff.shape)
+                )
+            diff_image[count] = diff
+        diff = np.abs(diff)
+        differing += int(np.count_nonzero(diff))
+        max_diff = max(max_diff, float(diff.max()))
+        total_diff += float(diff.sum())
+        pixels += diff.size
+    if diff_image is not None:
+        diff_image.flush()
+        del diff_image
+    hash1 = hash1.hexdigest()
+    hash2 = hash2.hexdigest()
+    return {
+        "frames": frames1,
+        "pixels": pixels,
+        "equal": hash1 == hash2,
+        "hash1": hash1,
+        "hash2": hash2,
+        "differing_pixels": differing,
+        "max_abs_diff": max_diff,
+        "mean_abs_diff": total_diff / pixels if pixels else 0.0,
+    }
+
+
+def compare_pixel_files(paths: list, rescale: bool = True, diff_folder: str = None):
+    """
+    Compare the pixel data of any number of dicom files with the first one
+
+    Parameters
+    ----------
+    paths : list of paths to dicom files
+    rescale : see compare_pixels()
+    diff_folder : optional folder for difference images, saved as
+        diff_<file>.npy for every file after the first
+
+    Returns
+    -------
+    pandas DataFrame with one row per file after the first, see compare_pixels()
+    """
+    rows = []
+    for path in paths[1:]:
+        diff_path = None
+        if diff_folder is not None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            diff_path = os.path.join(diff_folder, f"diff_{name}.npy")
+        row = {"file1": os.path.basename(paths[0]), "file2": os.path.basename(path)}
+        row["space"] = "rescaled" if rescale else "stored"
+        try:
+            row.update(compare_pixels(paths[0], path, rescale, diff_path))
+        except Exception as e:
+            # record decode errors (e.g. a missing or failing decoder) per file
+            row["error"] = f"{type(e).__name__}: {e}"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_comparison(df, destpath: str, timestamp: str, name: str = "compared"):
+    """
+    Save a comparison as html and csv in destpath
+
+    Returns
+    -------
+    (htmlpath, csvpath)
+    """
+    htmlpath = os.path.join(destpath, f"{name}_{timestamp}.html")
+    csvpath = os.path.join(destpath, f"{name}_{timestamp}.csv")
+    df.to_html(htmlpath, index=False)
+    df.to_csv(csvpath, index=False)
+    return htmlpath, csvpath
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to index the dicom headers of an image archive in a local
+SQLite database and to query it for instances or series
+
+update: python index_cmd.py update archive.db <folder> [<folder> ...]
+query:  python index_cmd.py query archive.db --station CT03 --description "%axial%"
+
+"""
+import os
+import sys
+import argparse
+import csv
+
+# add path for importing indexfunctions.py
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import indexfunctions
+
+parser = argparse.ArgumentParser(
+    description="Index DICOM headers in SQLite and query series",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+update_parser = subparsers.add_parser(
+    "update", help="add new and changed files to the index"
+)
+update_parser.add_argument("db", help="path to index database file")
+update_parser.add_argument("src", nargs="+", help="folders to index")
+update_parser.add_argument(
+    "--workers", type=int, default=4, help="number of threads reading headers"
+)
+
+query_parser = subparsers.add_parser("query", help="query the index")
+query_parser.add_argument("db", help="path to index database file")
+query_parser.add_argument(
+    "--station", help="StationName, exact (indexed) or with LIKE wildcards (%% and _)"
+)
+query_parser.add_argument(
+    "--description",
+    help="SeriesDescription, exact (indexed) or with LIKE wildcards (i.e. %%axial%%)",
+)
+query_parser.add_argument("--patient", help="PatientName or PatientID")
+query_parser.add_argument("--modality", help="Modality (i.e. CT)")
+query_parser.add_argument("--series-uid", help="SeriesInstanceUID")
+query_parser.add_argument("--date-from", help="first StudyDate, YYYYMMDD")
+query_parser.add_argument("--date-to", help="last StudyDate, YYYYMMDD")
+query_parser.add_argument(
+    "--instances",
+    action="store_true",
+    help="list every instance instead of one line per series",
+)
+args = parser.parse_args()
+
+config = vars(args)
+conn = indexfunctions.open_index(config["db"])
+
+if config["command"] == "update":
+    counts = indexfunctions.update_index(conn, config["src"], workers=config["workers"])
+    print(f"indexed {counts['indexed']} new or changed items")
+    print(f"{counts['unchanged']} items unchanged")
+    print(f"skipped {counts['not_dicom']} non-DICOM items")
+    print(f"removed {counts['removed']} deleted items from index")
+else:
+    filters = {
+        "station": config["station"],
+        "description": config["description"],
+        "patient": config["patient"],
+        "modality": config["modality"],
+        "series_uid": config["series_uid"],
+        "date_from": config["date_from"],
+        "date_to": config["date_to"],
+    }
+    if config["instances"]:
+        rows = indexfunctions.query_instances(conn, **filters)
+    else:
+        rows = indexfunctions.query_series(conn, **filters)
+    if len(rows) > 0:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    kind = "instances" if config["instances"] else "series"
+    print(f"found {len(rows)} {kind}", file=sys.stderr)
+conn.close()
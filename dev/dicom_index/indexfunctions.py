@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for index_cmd.py
+
+Keeps key header fields of every dicom instance in an image archive in a local
+SQLite database, so series can be found with an indexed query instead of
+walking folders and opening every file.
+
+"""
+import os
+import sys
+import sqlite3
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+
+# add path for importing dicomfiles.py, shared with the other tools
+sys.path.insert(
+    1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common")
+)
+from dicomfiles import sniff_dicom
+
+# database column: dicom keyword of the header element stored in it
+index_columns = {
+    "patient_id": "PatientID",
+    "patient_name": "PatientName",
+    "study_uid": "StudyInstanceUID",
+    "series_uid": "SeriesInstanceUID",
+    "sop_uid": "SOPInstanceUID",
+    "modality": "Modality",
+    "series_description": "SeriesDescription",
+    "station_name": "StationName",
+    "study_date": "StudyDate",
+    "slice_location": "SliceLocation",
+}
+
+# header tags read for each instance, everything else is skipped
+index_tags = [pydicom.datadict.tag_for_keyword(x) for x in index_columns.values()]
+
+column_types = [
+    f"{x} {'REAL' if x == 'slice_location' else 'TEXT'}" for x in index_columns
+]
+create_table = f"""
+CREATE TABLE IF NOT EXISTS instances (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    transfer_syntax TEXT,
+    {", ".join(column_types)}
+)
+"""
+
+# text filters without wildcards compare case-insensitively (COLLATE NOCASE, like
+# LIKE does), the indexes on those columns use the same collation so they are used
+create_indexes = [
+    "CREATE INDEX IF NOT EXISTS idx_series ON instances (series_uid)",
+    "CREATE INDEX IF NOT EXISTS idx_study ON instances (study_uid)",
+    "DROP INDEX IF EXISTS idx_station_date",
+    "CREATE INDEX IF NOT EXISTS idx_station_nocase_date "
+    "ON instances (station_name COLLATE NOCASE, study_date)",
+    "CREATE INDEX IF NOT EXISTS idx_description_nocase "
+    "ON instances (series_description COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS idx_date ON instances (study_date)",
+    "CREATE INDEX IF NOT EXISTS idx_sop ON instances (sop_uid)",
+]
+
+# filter columns compared case-insensitively, UIDs are compared exactly
+nocase_columns = ["station_name", "series_description", "modality"]
+
+
+def open_index(db_path: str):
+    """
+    Open (and create if needed) the index database
+
+    Parameters
+    ----------
+    db_path : path to the SQLite database file
+
+    Returns
+    -------
+    sqlite3.Connection with rows returned as sqlite3.Row
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(create_table)
+    for statement in create_indexes:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def read_index_header(path: str):
+    """
+    Read the indexed header fields of one file, stopping before Pixel Data
+
+    Returns
+    -------
+    dict of column values, or None if the file is not dicom
+    """
+    if sniff_dicom(path) is not None:
+        return None
+    with open(path, "rb") as fp:
+        try:
+            img = pydicom.dcmread(fp, stop_before_pixels=True, specific_tags=index_tags)
+        except Exception:
+            return None
+    row = {}
+    for column, keyword in index_columns.items():
+        value = img.get(keyword)
+        if column == "slice_location":
+            row[column] = float(value) if value not in (None, "") else None
+        else:
+            row[column] = str(value) if value is not None else None
+    row["transfer_syntax"] = str(img.file_meta.get("TransferSyntaxUID", ""))
+    return row
+
+
+def update_index(conn, src_dirs: list, workers: int = 4):
+    """
+    Bring the index up to date with the files found in src_dirs. Files with the
+    same size and mtime as their index row are not opened again, new and changed
+    files are read (header only) in a thread pool, and rows of files that no
+    longer exist under src_dirs are removed.
+
+    Parameters
+    ----------
+    conn : connection from open_index()
+    src_dirs : list of folders to index
+    workers : number of threads reading headers
+
+    Returns
+    -------
+    {"unchanged": int, "indexed": int, "not_dicom": int, "removed": int}
+    """
+    counts = {"unchanged": 0, "indexed": 0, "not_dicom": 0, "removed": 0}
+    for src_dir in src_dirs:
+        root = os.path.abspath(src_dir)
+        prefix = os.path.join(root, "")
+        known = {
+            row["path"]: (row["size"], row["mtime"])
+            for row in conn.execute(
+                "SELECT path, size, mtime FROM instances "
+                "WHERE substr(path, 1, length(?)) = ?",
+                (prefix, prefix),
+            )
+        }
+        seen = set()
+        changed = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    counts["unchanged"] += 1
+                else:
+                    changed.append((path, stat.st_size, stat.st_mtime_ns))
+
+        def read(entry):
+            try:
+                return entry, read_index_header(entry[0])
+            except OSError:
+                return entry, None
+
+        columns = ["path", "size", "mtime", "transfer_syntax", *index_columns]
+        insert = (
+            f"INSERT OR REPLACE INTO instances ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for x in columns)})"
+        )
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            for count, ((path, size, mtime), row) in enumerate(pool.map(read, changed)):
+                if row is None:
+                    counts["not_dicom"] += 1
+                    conn.execute("DELETE FROM instances WHERE path = ?", (path,))
+                    continue
+                row.update({"path": path, "size": size, "mtime": mtime})
+                conn.execute(insert, [row[x] for x in columns])
+                counts["indexed"] += 1
+                if count % 1000 == 0:
+                    conn.commit()
+        removed = [(path,) for path in known if path not in seen]
+        conn.executemany("DELETE FROM instances WHERE path = ?", removed)
+        counts["removed"] += len(removed)
+        conn.commit()
+    return counts
+
+
+def text_filter(column: str, value: str):
+    """
+    SQL condition comparing column with one parameter, LIKE if value contains a
+    % or _ wildcard, otherwise = (case-insensitive except for UIDs)
+    """
+    if "%" in value or "_" in value:
+        return f"{column} LIKE ?"
+    if column in nocase_columns:
+        return f"{column} = ? COLLATE NOCASE"
+    return f"{column} = ?"
+
+
+def build_filters(
+    station=None,
+    description=None,
+    patient=None,
+    modality=None,
+    date_from=None,
+    date_to=None,
+    series_uid=None,
+):
+    """
+    Build an SQL WHERE clause and parameters for querying the index. Text filters
+    accept SQL LIKE wildcards (i.e. "%axial%"), dates are YYYYMMDD strings.
+    Values without a % or _ wildcard are compared with = so the indexes on
+    series_uid, station_name and series_description are used, LIKE (which
+    reads every row) is only used for values with wildcards.
+
+    Returns
+    -------
+    (where, params)
+    """
+    clauses = []
+    params = []
+    for column, value in [
+        ("station_name", station),
+        ("series_description", description),
+        ("modality", modality),
+        ("series_uid", series_uid),
+    ]:
+        if value is not None:
+            clauses.append(text_filter(column, value))
+            params.append(value)
+    if patient is not None:
+        clauses.append(
+            f"({text_filter('patient_name', patient)} "
+            f"OR {text_filter('patient_id', patient)})"
+        )
+        params.extend([patient, patient])
+    if date_from is not None:
+        clauses.append("study_date >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        clauses.append("study_date <= ?")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def instances_query(**filters):
+    """
+    SQL and parameters of query_instances(), see build_filters()
+    """
+    where, params = build_filters(**filters)
+    sql = f"SELECT * FROM instances {where} ORDER BY series_uid, slice_location"
+    return sql, params
+
+
+def series_query(**filters):
+    """
+    SQL and parameters of query_series(), see build_filters(). The series columns
+    are aggregated with MIN() so every series gets well defined values even when
+    its instances disagree, instead of those of an arbitrary instance.
+    """
+    where, params = build_filters(**filters)
+    sql = f"""
+        SELECT series_uid, MIN(series_description) AS series_description,
+            MIN(station_name) AS station_name, MIN(study_date) AS study_date,
+            MIN(patient_name) AS patient_name, MIN(modality) AS modality,
+            COUNT(*) AS instances, MIN(path) AS first_path
+        FROM instances {where}
+        GROUP BY series_uid
+        ORDER BY study_date, station_name, series_description
+        """
+    return sql, params
+
+
+def query_instances(conn, **filters):
+    """
+    Query indexed instances, see build_filters() for the filter arguments
+
+    Returns
+    -------
+    list of dicts, one per instance, sorted by series and slice location
+    """
+    rows = conn.execute(*instances_query(**filters))
+    return [dict(row) for row in rows]
+
+
+def query_series(conn, **filters):
+    """
+    Query indexed series, see build_filters() for the filter arguments
+
+    Returns
+    -------
+    list of dicts with series_uid, series_description, station_name, study_date,
+    patient_name, modality, instances (count) and folder (folder of first instance)
+    """
+    rows = conn.execute(*series_query(**filters))
+    series = []
+    for row in rows:
+        entry = dict(row)
+        entry["folder"] = os.path.dirname(entry.pop("first_path"))
+        series.append(entry)
+    return series
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for indexfunctions.py, run with pytest from this folder
+
+"""
+import os
+import sys
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import indexfunctions
+
+
+def query_plan(conn, sql, params):
+    """
+    Details of each step of the SQLite query plan for sql
+    """
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return " | ".join(row["detail"] for row in rows)
+
+
+def test_series_uid_uses_index():
+    conn = indexfunctions.open_index(":memory:")
+    sql, params = indexfunctions.series_query(series_uid="1.2.3.4")
+    assert "= ?" in sql
+    assert "USING INDEX idx_series" in query_plan(conn, sql, params)
+
+
+def test_station_and_dates_use_index():
+    conn = indexfunctions.open_index(":memory:")
+    sql, params = indexfunctions.instances_query(
+        station="CT03", date_from="20260101", date_to="20261231"
+    )
+    assert "idx_station_nocase_date" in query_plan(conn, sql, params)
+
+
+def test_description_uses_index():
+    conn = indexfunctions.open_index(":memory:")
+    sql, params = indexfunctions.series_query(description="ACR Axial")
+    assert "idx_description_nocase" in query_plan(conn, sql, params)
+
+
+def test_wildcards_use_like():
+    sql, params = indexfunctions.series_query(description="%axial%")
+    assert "series_description LIKE ?" in sql
+    assert params == ["%axial%"]
+
+
+def test_exact_match_ignores_case():
+    conn = indexfunctions.open_index(":memory:")
+    for path, description in [("a.dcm", "ACR Axial"), ("b.dcm", "acr axial")]:
+        row = {"path": path, "series_uid": "1.2.3", "series_description": description}
+        conn.execute(
+            f"INSERT INTO instances ({', '.join(row)}) "
+            f"VALUES ({', '.join('?' for x in row)})",
+            list(row.values()),
+        )
+    rows = indexfunctions.query_instances(conn, description="ACR AXIAL")
+    assert [x["path"] for x in rows] == ["a.dcm", "b.dcm"]
+    series = indexfunctions.query_series(conn, description="ACR AXIAL")
+    assert len(series) == 1
+    assert series[0]["instances"] == 2
+    assert series[0]["series_description"] == "ACR Axial"
@@ -10,55 +10,361 @@ dicom file
 """
 import os
 import sys
+import json
 import argparse
-import pydicom
+import threading
 import pprint
-import shutil
+
+# add path for importing organizefunctions.py
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import organizefunctions
 
 parser = argparse.ArgumentParser(
     description="Separate and name DICOM files by series UID",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
 )
-parser.add_argument("src", help="source folder where dicom files/folders are located")
 parser.add_argument(
-    "dest", help="destination folder to save newly organized image folders"
+    "src", nargs="?", help="source folder where dicom files/folders are located"
+)
+parser.add_argument(
+    "dest", nargs="?", help="destination folder to save newly organized image folders"
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="number of worker threads for reading and copying files in parallel",
+)
+parser.add_argument(
+    "--mode",
+    choices=organizefunctions.placement_modes,
+    default="copy",
+    help="how to place files in the destination, falls back to copy if the mode fails",
+)
+parser.add_argument(
+    "--list-workers",
+    type=int,
+    default=8,
+    help="number of folders listed in parallel while walking the source tree",
+)
+parser.add_argument(
+    "--full",
+    action="store_true",
+    help="ignore the destination manifest and organize every file again",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="continue an interrupted run, skipping files its journal shows were placed",
+)
+parser.add_argument(
+    "--no-preamble",
+    action="store_true",
+    help="also accept dicom files without the 128 byte preamble and DICM prefix",
+)
+parser.add_argument(
+    "--plan",
+    metavar="PLANFILE",
+    help="only read headers and write what would be placed where to PLANFILE "
+    "(json, plus a csv with the same name), dest is not touched",
+)
+parser.add_argument(
+    "--apply",
+    metavar="PLANFILE",
+    help="place the files listed in a plan written with --plan, src and dest "
+    "are taken from the plan",
+)
+parser.add_argument(
+    "--dedup",
+    choices=["skip", "hardlink"],
+    help="place each instance (SOPInstanceUID) once, further copies are skipped "
+    "or hardlinked to the placed copy",
+)
+parser.add_argument(
+    "--verify-hash",
+    action="store_true",
+    help="with --dedup, only treat files as duplicates if their content matches",
+)
+parser.add_argument(
+    "--deid",
+    choices=list(organizefunctions.deid_profiles),
+    help="write de-identified copies using this profile, header elements are "
+    "rewritten and Pixel Data is copied unchanged. Both profiles keep all dates. "
+    "basic derives new UIDs from the originals and the site secret in "
+    f"${organizefunctions.deid_salt_variable}, set it to a private value. With "
+    "--plan the profile is stored in the plan and used by --apply",
+)
+parser.add_argument(
+    "--report",
+    metavar="REPORTFILE",
+    help="write the json run report (rates, time per stage, errors by type) here "
+    f"instead of {organizefunctions.report_name} in dest",
+)
+parser.add_argument(
+    "--progress",
+    action="store_true",
+    help="show a live progress line while organizing",
 )
 args = parser.parse_args()
+if args.apply is None and (args.src is None or args.dest is None):
+    parser.error("src and dest are required unless --apply is used")
+if args.apply is not None and args.deid is not None:
+    parser.error("--deid is stored in the plan, use it with --plan instead of --apply")
 
 config = vars(args)
-imgdir = config["src"]
-dest_dir = config["dest"]
-
-# list all files down the folder tree
-files = [
-    os.path.join(dirpath, f)
-    for (dirpath, dirnames, filenames) in os.walk(imgdir)
-    for f in filenames
-]
-
-# files = [os.path.join(imgdir, x) for x in os.listdir(imgdir)]
-
-contents = []
-failed_contents = []
-for item in files:
-    try:
-        img = pydicom.dcmread(item)
-        seriesInstanceUID = img[0x0020000E].value
-        seriesDesc = img[0x0008103E].value or "SeriesDescription"
-        imagename = f"{seriesDesc}-{os.path.basename(item)}"
-        foldername = f"{seriesDesc}-{seriesInstanceUID}"
-        folderpath = os.path.join(dest_dir, foldername)
-
-        if not os.path.exists(folderpath):
-            os.makedirs(folderpath)
-        shutil.copyfile(item, os.path.join(folderpath, imagename))
-
-    except:
-        print(f"unknown error with item: {item}")
-        failed_contents.append(item)
+if (
+    config["deid"] is not None
+    and organizefunctions.deid_profiles[config["deid"]]["remap_uids"]
+    and not os.environ.get(organizefunctions.deid_salt_variable)
+):
+    print(
+        f"warning: {organizefunctions.deid_salt_variable} is not set, the new UIDs "
+        "can be computed by anyone who has the original UIDs"
+    )
+if config["apply"] is not None:
+    plan = organizefunctions.load_plan(config["apply"])
+    dest_dir = plan["dest_dir"]
+else:
+    imgdir = config["src"]
+    dest_dir = os.path.abspath(config["dest"])
+
+# skip files already organized by a previous run
+manifest = {} if config["full"] else organizefunctions.load_manifest(dest_dir)
+
+# recover files placed by an interrupted run from its journal
+resumed = {}
+completed = []
+if config["resume"]:
+    completed, redo = organizefunctions.replay_journal(dest_dir)
+    resumed = organizefunctions.update_manifest(manifest, completed)
+    print(f"resuming, {len(completed)} items verified from previous run")
+    if len(redo) > 0:
+        print(f"{len(redo)} items from previous run failed verification, redoing")
+
+# instances placed by earlier runs or earlier in this run
+dedup = None
+if config["dedup"] is not None:
+    dedup = organizefunctions.new_dedup(
+        config["dedup"], verify=config["verify_hash"], manifest=manifest
+    )
+
+metrics = organizefunctions.new_metrics()
+unchanged = []
+
+
+def changed_files():
+    """
+    walk the folder tree and yield files not organized by a previous run, the
+    walk runs alongside organizing so copying starts with the first folder
+    """
+    for item in organizefunctions.walk_files([imgdir], config["list_workers"], metrics):
+        if organizefunctions.is_unchanged(item, manifest):
+            unchanged.append(item)
+        else:
+            yield item
+
+
+# live progress line on stderr, updated once per second until the run is done
+done = threading.Event()
+
+
+def show_progress():
+    while not done.wait(1):
+        line = organizefunctions.progress_line(metrics)
+        print(f"\r{line}", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+
+progress = threading.Thread(target=show_progress, daemon=True)
+if config["progress"]:
+    progress.start()
+
+
+def write_report(path: str):
+    """
+    stop the progress line and write the json run report to path
+    """
+    done.set()
+    if progress.is_alive():
+        progress.join()
+    report = organizefunctions.metrics_report(metrics)
+    report.update(
+        {
+            "src": imgdir if config["apply"] is None else config["apply"],
+            "dest": dest_dir,
+            "mode": config["mode"],
+            "workers": config["workers"],
+            "unchanged": len(unchanged),
+        }
+    )
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+if config["plan"] is not None:
+    plan = organizefunctions.plan_files(
+        changed_files(),
+        dest_dir,
+        workers=config["workers"],
+        allow_no_preamble=config["no_preamble"],
+        deid=config["deid"],
+        metrics=metrics,
+    )
+    if config["report"] is not None:
+        write_report(config["report"])
+    else:
+        done.set()
+    csv_path = organizefunctions.save_plan(config["plan"], plan)
+    bytes_read = sum(entry["bytes_read"] for entry in plan["entries"])
+    if len(unchanged) > 0:
+        print(f"skipping {len(unchanged)} unchanged items already organized")
+    print(
+        f"plan: {plan['files']} items in {len(plan['series'])} series, "
+        f"{organizefunctions.format_bytes(plan['bytes'])} to place"
+    )
+    for foldername, counts in sorted(plan["series"].items()):
+        print(f"  {foldername}: {counts['instances']} items")
+    for reason, items in plan["skipped"].items():
+        print(f"skipped {len(items)} non-DICOM items: {reason}")
+    print(f"read {organizefunctions.format_bytes(bytes_read)} of headers")
+    if len(plan["collisions"]) > 0:
+        print(
+            f"{len(plan['collisions'])} destinations are planned for several items, "
+            "different instances get their SOPInstanceUID appended when applied"
+        )
+    if len(plan["duplicates"]) > 0:
+        duplicate_count = sum(len(x) - 1 for x in plan["duplicates"].values())
+        print(
+            f"{duplicate_count} items are further copies of "
+            f"{len(plan['duplicates'])} instances, see --dedup"
+        )
+    if len(plan["existing"]) > 0:
+        print(
+            f"{len(plan['existing'])} destinations already exist and would be replaced"
+        )
+    if len(plan["failed"]) > 0:
+        print(f"Failed {len(plan['failed'])} items:")
+        pprint.pp(plan["failed"])
+    print(f"plan written to {config['plan']} and {csv_path}")
+    print(f"run with --apply {config['plan']} to place the files")
+    sys.exit()
+
+journal = organizefunctions.open_journal(dest_dir, resume=config["resume"])
+if config["apply"] is not None:
+    if len(completed) > 0:
+        # entries the interrupted run already placed are not placed again
+        placed = {x["item"] for x in completed}
+        entries = [x for x in plan["entries"] if x["item"] not in placed]
+        print(f"skipping {len(plan['entries']) - len(entries)} items placed before")
+        plan = dict(plan, entries=entries)
+    results, failed_contents, changed = organizefunctions.apply_plan(
+        plan,
+        workers=config["workers"],
+        mode=config["mode"],
+        journal=journal,
+        dedup=dedup,
+        metrics=metrics,
+    )
+    skipped = {}
+    if len(changed) > 0:
+        print(f"skipped {len(changed)} items changed since the plan, run --plan again")
+else:
+    results, failed_contents, skipped = organizefunctions.organize_files(
+        changed_files(),
+        dest_dir,
+        workers=config["workers"],
+        mode=config["mode"],
+        journal=journal,
+        allow_no_preamble=config["no_preamble"],
+        dedup=dedup,
+        deid=config["deid"],
+        metrics=metrics,
+    )
+entries = organizefunctions.update_manifest(manifest, results)
+organizefunctions.append_manifest(dest_dir, {**resumed, **entries})
+organizefunctions.close_journal(journal, dest_dir)
+folders = {os.path.dirname(x["dest"]) for x in results + completed}
+series_index = organizefunctions.index_series({}, manifest)
+summaries = organizefunctions.write_series_summaries(manifest, folders, series_index)
+organizefunctions.write_series_manifests(manifest, folders, series_index)
+incomplete = {x: y for x, y in summaries.items() if not y["complete"]}
+report_path = config["report"] or os.path.join(dest_dir, organizefunctions.report_name)
+report = write_report(report_path)
+bytes_read = sum(result["bytes_read"] for result in results)
+bytes_total = sum(result["file_size"] for result in results)
+bytes_written = sum(result["bytes_written"] for result in results)
+duplicates = [x for x in results if "duplicate_of" in x]
+fallback_count = len(
+    [
+        x
+        for x in results
+        if x["placement"] not in [config["mode"], "deidentify"]
+        and "duplicate_of" not in x
+    ]
+)
+deid_count = len([x for x in results if x["placement"] == "deidentify"])
 fail_count = len(failed_contents)
-print(f"processed {len(files) - fail_count} items successfully")
+if len(unchanged) > 0:
+    print(f"skipped {len(unchanged)} unchanged items already organized")
+print(f"processed {len(results)} items successfully")
+for reason, items in skipped.items():
+    print(f"skipped {len(items)} non-DICOM items: {reason}")
+if config["apply"] is not None:
+    plan_bytes_read = sum(result["plan_bytes_read"] for result in results)
+    print(
+        f"no headers read, {organizefunctions.format_bytes(plan_bytes_read)} "
+        "of headers were read when the plan was made"
+    )
+else:
+    print(
+        f"read {organizefunctions.format_bytes(bytes_read)} of headers, "
+        f"skipped {organizefunctions.format_bytes(bytes_total - bytes_read)} "
+        "of pixel data"
+    )
+print(f"wrote {organizefunctions.format_bytes(bytes_written)} to destination")
+if deid_count > 0:
+    print(f"{deid_count} items were written de-identified")
+if dedup is not None:
+    saved = sum(x["file_size"] - x["bytes_written"] for x in duplicates)
+    linked = len([x for x in duplicates if x["placement"] == "hardlink"])
+    print(
+        f"{len(duplicates)} duplicate items of {len(dedup['duplicates'])} instances "
+        f"were not placed again ({linked} hardlinked under their own name), "
+        f"saving {organizefunctions.format_bytes(saved)}"
+    )
+    for sop_uid, items in list(dedup["duplicates"].items())[:10]:
+        print(f"  {sop_uid}: {len(items)} copies")
+    if len(dedup["duplicates"]) > 10:
+        print(f"  ... and {len(dedup['duplicates']) - 10} more instances")
+    if len(dedup["conflicts"]) > 0:
+        print(
+            f"{len(dedup['conflicts'])} items share a SOPInstanceUID with different "
+            "content, placed with their hash appended:"
+        )
+        pprint.pp(dedup["conflicts"])
+if fallback_count > 0:
+    print(f"{fallback_count} items were copied, {config['mode']} was not possible")
+if len(incomplete) > 0:
+    print(f"{len(incomplete)} of {len(summaries)} series may be incomplete:")
+    for folder, summary in sorted(incomplete.items()):
+        print(f"  {os.path.basename(folder)}: {', '.join(summary['problems'])}")
+print(
+    f"{report['files_per_second']} items/s, "
+    f"read {report['mb_per_second_read']} MB/s "
+    f"({organizefunctions.format_bytes(report['header_bytes_read'])} of headers, "
+    f"{organizefunctions.format_bytes(report['place_bytes_read'])} while placing), "
+    f"wrote {report['mb_per_second_written']} MB/s "
+    f"in {report['elapsed_seconds']}s"
+)
+print(
+    "time per stage (summed over threads): "
+    + ", ".join(f"{x} {y}s" for x, y in report["stage_seconds"].items())
+)
 if len(failed_contents) > 0:
     print(f"Failed {fail_count} items:")
-    pprint.pp(failed_contents)
+    for error, items in report["errors"].items():
+        print(f"  {error}: {len(items)} items")
+        pprint.pp([x["item"] for x in items])
+print(f"run report written to {report_path}")
 print(f"check destination folder: {dest_dir}")
@@ -0,0 +1,1584 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for organize_cmd.py
+
+Reading, placing and bookkeeping for separating a bulk set of dicom files
+into <SeriesDescription>-<SeriesInstanceUID> folders.
+
+"""
+import os
+import sys
+import io
+import csv
+import json
+import shutil
+import uuid
+import hashlib
+import threading
+import time
+import pydicom
+
+# add path for importing dicomfiles.py, shared with the other tools
+# (walk_files is also used by the scripts as organizefunctions.walk_files)
+sys.path.insert(
+    1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common")
+)
+from dicomfiles import (
+    sniff_dicom,
+    timed,
+    walk_files,
+    bounded_map,
+    summary_name,
+    series_summary,
+)
+
+# ways of placing a source file at its destination, see place_file()
+placement_modes = ["copy", "hardlink", "symlink", "move", "reflink"]
+
+# linux ioctl request number for cloning a file (copy-on-write reflink)
+FICLONE = 0x40049409
+
+# header elements needed to decide where an instance belongs
+organize_tags = [
+    0x0020000E,  # SeriesInstanceUID
+    0x0008103E,  # SeriesDescription
+    0x00080018,  # SOPInstanceUID
+    0x00180050,  # SliceThickness
+    0x00200032,  # ImagePositionPatient
+    0x00201041,  # SliceLocation
+    0x00280010,  # Rows
+    0x00280011,  # Columns
+    0x00280030,  # PixelSpacing
+    0x00281052,  # RescaleIntercept
+    0x00281053,  # RescaleSlope
+]
+
+# file in the destination folder recording what has already been organized, one
+# json line per source file appended by each run, later lines replace earlier ones
+manifest_name = "organize_manifest.jsonl"
+
+# write-ahead journal of planned and completed placements for the current run
+journal_name = "organize_journal.jsonl"
+
+# de-identification profiles, see deidentify_dataset()
+# replace : {keyword: value} set on the dataset, "" leaves an empty element
+# remove : keywords of elements deleted wherever they occur, including sequences
+# remove_private : delete all private elements
+# remap_uids : replace instance UIDs with new ones derived from the original UID,
+# so every file of a study still gets the same new study and series UIDs
+# Neither profile removes or shifts dates (study, series, acquisition, content...)
+deid_profiles = {
+    "basic": {
+        "replace": {
+            "PatientName": "ANONYMIZED",
+            "PatientID": "ANONYMIZED",
+            "PatientBirthDate": "",
+            "PatientSex": "",
+            "AccessionNumber": "",
+            "ReferringPhysicianName": "",
+            "StudyID": "",
+        },
+        "remove": [
+            "OtherPatientIDs",
+            "OtherPatientIDsSequence",
+            "OtherPatientNames",
+            "PatientBirthTime",
+            "PatientAddress",
+            "PatientTelephoneNumbers",
+            "PatientMotherBirthName",
+            "PatientAge",
+            "PatientComments",
+            "IssuerOfPatientID",
+            "AdmissionID",
+            "MedicalRecordLocator",
+            "InstitutionName",
+            "InstitutionAddress",
+            "InstitutionalDepartmentName",
+            "StationName",
+            "DeviceSerialNumber",
+            "PerformingPhysicianName",
+            "OperatorsName",
+            "PhysiciansOfRecord",
+            "NameOfPhysiciansReadingStudy",
+            "RequestingPhysician",
+            "RequestAttributesSequence",
+        ],
+        "remove_private": True,
+        "remap_uids": True,
+    },
+    # phantom and test patient data: keeps institution, station and dates needed
+    # for QA reports
+    "phantom": {
+        "replace": {
+            "PatientName": "ANONYMIZED",
+            "PatientID": "ANONYMIZED",
+            "PatientBirthDate": "",
+            "AccessionNumber": "",
+            "ReferringPhysicianName": "",
+        },
+        "remove": [
+            "OtherPatientIDs",
+            "OtherPatientIDsSequence",
+            "OtherPatientNames",
+            "PatientAddress",
+            "PatientTelephoneNumbers",
+            "PatientComments",
+            "PerformingPhysicianName",
+            "OperatorsName",
+            "PhysiciansOfRecord",
+            "NameOfPhysiciansReadingStudy",
+            "RequestingPhysician",
+        ],
+        "remove_private": False,
+        "remap_uids": False,
+    },
+}
+
+# environment variables holding the site secret mixed into remapped UIDs and an
+# optional UID root ("1.2.3.") for them, see remap_uid()
+deid_salt_variable = "ORGANIZE_DEID_SALT"
+deid_prefix_variable = "ORGANIZE_DEID_UID_ROOT"
+
+# run report written to the destination folder, see metrics_report()
+report_name = "organize_report.json"
+
+# folder in dest for received images that could not be organized
+failed_folder = "failed"
+
+# folder in dest where received images are written before they are acknowledged
+incoming_folder = "incoming"
+
+# file in each series folder listing its instances and their image geometry
+series_manifest_name = "series_manifest.json"
+
+
+def read_header(path: str, tags: list = organize_tags, force: bool = False):
+    """
+    Read only the header elements listed in `tags`, stopping before Pixel Data.
+    Values of all other elements are skipped over rather than parsed.
+
+    Parameters
+    ----------
+    path : path to a dicom file
+    tags : list of int tags to keep (default organize_tags)
+    force : read files without preamble and DICM prefix
+
+    Returns
+    -------
+    (img, bytes_read, file_size)
+    img : pydicom.dataset.FileDataset containing only the requested elements
+    bytes_read : file position reached when parsing stopped
+    file_size : size of the file on disk in bytes
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as fp:
+        img = pydicom.dcmread(
+            fp, stop_before_pixels=True, specific_tags=tags, force=force
+        )
+        bytes_read = fp.tell()
+    return img, bytes_read, file_size
+
+
+def series_names(img, item: str):
+    """
+    Build the destination folder and image names for a dicom file
+
+    Parameters
+    ----------
+    img : pydicom dataset containing SeriesInstanceUID and optionally SeriesDescription
+    item : original path of the file
+
+    Returns
+    -------
+    (foldername, imagename)
+    """
+    seriesInstanceUID = img[0x0020000E].value
+    seriesDesc = img.get(0x0008103E)
+    seriesDesc = (seriesDesc.value if seriesDesc else "") or "SeriesDescription"
+    imagename = f"{seriesDesc}-{os.path.basename(item)}"
+    foldername = f"{seriesDesc}-{seriesInstanceUID}"
+    return foldername, imagename
+
+
+def slice_info(img):
+    """
+    Slice geometry of a header read with organize_tags
+
+    Returns
+    -------
+    {"location": float or None, "position": [x, y, z] or None,
+    "thickness": float or None}
+    """
+    location = img.get("SliceLocation")
+    position = img.get("ImagePositionPatient")
+    thickness = img.get("SliceThickness")
+    return {
+        "location": float(location) if location not in (None, "") else None,
+        "position": [float(x) for x in position] if position else None,
+        "thickness": float(thickness) if thickness not in (None, "") else None,
+    }
+
+
+def image_info(img):
+    """
+    Image geometry and transfer syntax of a header read with organize_tags,
+    keyed by dicom keyword
+
+    Returns
+    -------
+    {"Rows": int, "Columns": int, "PixelSpacing": [float, float],
+    "RescaleSlope": float, "RescaleIntercept": float, "TransferSyntaxUID": str},
+    missing values are None
+    """
+    spacing = img.get("PixelSpacing")
+    info = {
+        "Rows": img.get("Rows"),
+        "Columns": img.get("Columns"),
+        "PixelSpacing": [float(x) for x in spacing] if spacing else None,
+    }
+    for keyword in ["RescaleSlope", "RescaleIntercept"]:
+        value = img.get(keyword)
+        info[keyword] = float(value) if value not in (None, "") else None
+    info["TransferSyntaxUID"] = str(img.file_meta.get("TransferSyntaxUID", ""))
+    return info
+
+
+def format_bytes(num: float):
+    """
+    Human readable byte count (i.e. 1.5 GB)
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num) < 1024:
+            return f"{num:.1f} {unit}"
+        num = num / 1024
+    return f"{num:.1f} TB"
+
+
+def make_folder(folderpath: str, created: set):
+    """
+    Create folderpath once per run. Folders already in `created` are assumed
+    to exist so repeat calls cost a set lookup instead of a stat + mkdir.
+    """
+    if folderpath not in created:
+        os.makedirs(folderpath, exist_ok=True)
+        created.add(folderpath)
+
+
+def temp_name(dst: str):
+    """
+    Unique hidden temporary path in the same folder as dst, used for writing
+    a file before it is renamed into place
+    """
+    folder, name = os.path.split(dst)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex[:12]}.part")
+
+
+def atomic_copy(src: str, dst: str):
+    """
+    Copy src to a temporary file next to dst and rename it into place, so a
+    crashed or interrupted copy never leaves a partially written file at dst.
+    """
+    temp_path = temp_name(dst)
+    try:
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dst)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def reflink(src: str, dst: str):
+    """
+    Create dst as a copy-on-write clone of src. Only supported on linux
+    filesystems with reflink support (btrfs, xfs, ...), raises OSError otherwise.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflink is not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def place_file(src: str, dst: str, mode: str = "copy"):
+    """
+    Place src at dst using one of placement_modes. Links and clones are created
+    under a temporary name and renamed into place like atomic_copy. If the
+    requested mode fails (different volume, unsupported filesystem, no
+    permission for symlinks...) the file is copied instead.
+
+    Parameters
+    ----------
+    src : source file path
+    dst : destination file path
+    mode : "copy", "hardlink", "symlink", "move" or "reflink"
+
+    Returns
+    -------
+    mode actually used, "copy" when the requested mode fell back to copying
+    """
+    if mode not in placement_modes:
+        raise ValueError(f"unknown placement mode: {mode}")
+    if mode == "copy":
+        atomic_copy(src, dst)
+        return "copy"
+    if mode == "move":
+        try:
+            os.replace(src, dst)
+        except OSError:
+            # different volume, copy then remove the source
+            atomic_copy(src, dst)
+            os.remove(src)
+        return "move"
+    temp_path = temp_name(dst)
+    try:
+        if mode == "hardlink":
+            os.link(src, temp_path)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), temp_path)
+        else:
+            reflink(src, temp_path)
+        os.replace(temp_path, dst)
+        return mode
+    except OSError:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        atomic_copy(src, dst)
+        return "copy"
+
+
+def remap_uid(uid: str):
+    """
+    New UID derived from uid, the same uid always maps to the same new UID.
+    Well-known UIDs (SOP classes, transfer syntaxes...) are returned unchanged.
+    The site secret in the deid_salt_variable environment variable is added to
+    the hashed sources, without it anyone holding the original UIDs can compute
+    the new ones. The UID root is taken from deid_prefix_variable if set.
+    """
+    uid = pydicom.uid.UID(str(uid))
+    if uid.name != uid:
+        return uid
+    salt = os.environ.get(deid_salt_variable, "")
+    prefix = os.environ.get(deid_prefix_variable) or pydicom.uid.PYDICOM_ROOT_UID
+    # generate_uid ignores entropy_srcs with prefix=None, keep a prefix
+    return pydicom.uid.generate_uid(
+        prefix=prefix, entropy_srcs=[salt, uid] if salt else [uid]
+    )
+
+
+def deidentify_dataset(img, profile: str):
+    """
+    Apply a de-identification profile (see deid_profiles) to a dataset in place
+
+    Parameters
+    ----------
+    img : pydicom dataset, may be read with stop_before_pixels=True
+    profile : name of a profile in deid_profiles
+    """
+    rules = deid_profiles[profile]
+    remove = {pydicom.datadict.tag_for_keyword(x) for x in rules["remove"]}
+
+    def clean(dataset, elem):
+        if elem.tag in remove or (elem.tag.element == 0 and elem.tag.group != 2):
+            # group lengths would be wrong after editing
+            del dataset[elem.tag]
+        elif rules["remap_uids"] and elem.VR == "UI" and elem.value:
+            if elem.VM > 1:
+                elem.value = [remap_uid(x) for x in elem.value]
+            else:
+                elem.value = remap_uid(elem.value)
+
+    img.walk(clean)
+    if rules["remove_private"]:
+        img.remove_private_tags()
+    for keyword, value in rules["replace"].items():
+        setattr(img, keyword, value)
+    if rules["remap_uids"] and "MediaStorageSOPInstanceUID" in img.file_meta:
+        img.file_meta.MediaStorageSOPInstanceUID = img.SOPInstanceUID
+    img.PatientIdentityRemoved = "YES"
+    img.DeidentificationMethod = f"organize_cmd {profile} profile"
+
+
+def deidentify_file(
+    src: str, dst: str, profile: str, force: bool = False, series_uid: str = None
+):
+    """
+    Write a de-identified copy of src to dst. Only the header is parsed and
+    rewritten, everything from the Pixel Data element on is copied from src
+    byte for byte without being read into memory or decoded. The file is
+    written under a temporary name and renamed into place like atomic_copy.
+
+    Parameters
+    ----------
+    src : source dicom file
+    dst : destination path
+    profile : name of a profile in deid_profiles
+    force : read files without preamble and DICM prefix
+    series_uid : optional SeriesInstanceUID the de-identified file must have
+    (the one its series folder was named after), a ValueError is raised and
+    nothing is written if it differs
+
+    Returns
+    -------
+    size of the written file in bytes
+    """
+    temp_path = temp_name(dst)
+    with open(src, "rb") as fsrc:
+        img = pydicom.dcmread(fsrc, stop_before_pixels=True, force=force)
+        # parsing stops at the start of the Pixel Data element
+        pixel_offset = fsrc.tell()
+        syntax = img.file_meta.get("TransferSyntaxUID")
+        if syntax == pydicom.uid.DeflatedExplicitVRLittleEndian:
+            raise ValueError(
+                f"cannot de-identify deflated file without inflating: {src}"
+            )
+        deidentify_dataset(img, profile)
+        if series_uid is not None and img.get("SeriesInstanceUID") != series_uid:
+            raise ValueError(
+                f"de-identified SeriesInstanceUID {img.get('SeriesInstanceUID')} "
+                f"does not match the planned series {series_uid}: {src}"
+            )
+        try:
+            with open(temp_path, "wb") as fdst:
+                pydicom.dcmwrite(fdst, img, write_like_original=True)
+                fsrc.seek(pixel_offset)
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            os.replace(temp_path, dst)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return os.path.getsize(dst)
+
+
+def plan_file(
+    item: str, dest_dir: str, allow_no_preamble: bool = False, deid: str = None
+):
+    """
+    Read the header of one dicom file and work out where it belongs in
+    dest_dir, without creating or writing anything.
+    Files rejected by sniff_dicom are skipped without being parsed.
+
+    Parameters
+    ----------
+    item : path to dicom file
+    dest_dir : destination folder for the series folders
+    allow_no_preamble : also accept dicom files without preamble, see sniff_dicom()
+    deid : optional de-identification profile applied when the file is placed,
+    see deid_profiles
+
+    Returns
+    -------
+    {"item": str, "dest": str, "series": str, "bytes_read": int,
+    "file_size": int, "mtime": int, "sop_uid": str, "slice": dict, "image": dict}
+    or {"item": str, "skipped": reason} for files that are not dicom
+    slice and image are the header fields returned by slice_info() and image_info()
+    """
+    reason = sniff_dicom(item, allow_no_preamble)
+    if reason is not None:
+        return {"item": item, "skipped": reason}
+    mtime = os.stat(item).st_mtime_ns
+    img, bytes_read, file_size = read_header(item, force=allow_no_preamble)
+    sop_uid = str(img.get("SOPInstanceUID", ""))
+    if deid is not None and deid_profiles[deid]["remap_uids"]:
+        # name the series folder after the UID the de-identified files will have
+        img.SeriesInstanceUID = remap_uid(img.SeriesInstanceUID)
+    foldername, imagename = series_names(img, item)
+    entry = {
+        "item": item,
+        "dest": os.path.join(dest_dir, foldername, imagename),
+        "series": foldername,
+        "bytes_read": bytes_read,
+        "file_size": file_size,
+        "mtime": mtime,
+        "sop_uid": sop_uid,
+        "slice": slice_info(img),
+        "image": image_info(img),
+    }
+    if deid is not None:
+        entry["deid"] = deid
+        entry["series_uid"] = str(img.SeriesInstanceUID)
+    return entry
+
+
+def place_entry(
+    entry: dict, created: set, mode: str = "copy", journal=None, metrics=None
+):
+    """
+    Place the file of a plan_file() entry at its destination. Entries with a
+    "deid" profile are written de-identified by deidentify_file() whatever the
+    placement mode.
+
+    Parameters
+    ----------
+    entry : dict returned by plan_file()
+    created : set of folders already created during this run
+    mode : placement mode, see place_file()
+    journal : optional journal from open_journal(), the placement is recorded
+    as planned before and done after the file is placed
+    metrics : optional metrics from new_metrics(), mkdir and place time is added
+
+    Returns
+    -------
+    entry with "placement", "bytes_written" and "place_bytes_read" (bytes of the
+    source read while placing, the whole file for copies and de-identification)
+    added
+    """
+    with timed(metrics, "mkdir"):
+        make_folder(os.path.dirname(entry["dest"]), created)
+    if journal is not None:
+        journal_record(journal, "plan", entry)
+    with timed(metrics, "place"):
+        if entry.get("deid") is not None:
+            entry["dest_size"] = deidentify_file(
+                entry["item"],
+                entry["dest"],
+                entry["deid"],
+                force=True,
+                series_uid=entry.get("series_uid"),
+            )
+            entry["placement"] = "deidentify"
+            entry["bytes_written"] = entry["dest_size"]
+            entry["place_bytes_read"] = entry["file_size"]
+        else:
+            placement = place_file(entry["item"], entry["dest"], mode)
+            entry["placement"] = placement
+            entry["bytes_written"] = entry["file_size"] if placement == "copy" else 0
+            entry["place_bytes_read"] = entry["bytes_written"]
+    if journal is not None:
+        journal_record(journal, "done", entry)
+    return entry
+
+
+def organize_file(
+    item: str,
+    dest_dir: str,
+    created: set,
+    mode: str = "copy",
+    journal=None,
+    allow_no_preamble: bool = False,
+    dedup=None,
+    deid: str = None,
+    metrics=None,
+):
+    """
+    Read the header of one dicom file and place it into its series folder,
+    see plan_file() and place_entry(). With dedup state from new_dedup()
+    duplicate instances are handled by place_unique(). With metrics from
+    new_metrics() the time spent in each stage is recorded.
+
+    Returns
+    -------
+    {"item": str, "dest": str, "series": str, "bytes_read": int,
+    "file_size": int, "mtime": int, "sop_uid": str, "placement": str,
+    "bytes_written": int}
+    or {"item": str, "skipped": reason} for files that are not dicom
+    """
+    with timed(metrics, "parse"):
+        result = plan_file(item, dest_dir, allow_no_preamble, deid)
+    if "skipped" in result:
+        return result
+    if dedup is not None:
+        return place_unique(result, created, dedup, mode, journal, metrics)
+    return place_entry(result, created, mode, journal, metrics)
+
+
+def new_dedup(mode: str = "skip", verify: bool = False, manifest: dict = None):
+    """
+    State shared by the threads of a run for recognizing instances (same
+    SOPInstanceUID) that were already placed, see place_unique()
+
+    Parameters
+    ----------
+    mode : "skip" to leave duplicates out, "hardlink" to link their destination
+    to the copy already placed
+    verify : only treat files as duplicates when their content (sha256) matches
+    manifest : organize manifest, instances organized by earlier runs count as
+    already placed
+
+    Returns
+    -------
+    {"mode", "verify", "lock", "kept": {sop_uid: kept instance},
+    "dests": {dest: sop_uid}, "duplicates": {sop_uid: [items]}, "conflicts": [items]}
+    """
+    if mode not in ["skip", "hardlink"]:
+        raise ValueError(f"unknown dedup mode: {mode}")
+    dedup = {
+        "mode": mode,
+        "verify": verify,
+        "lock": threading.Lock(),
+        "kept": {},
+        "dests": {},
+        "duplicates": {},
+        "conflicts": [],
+    }
+    for item, entry in (manifest or {}).items():
+        if entry["sop_uid"] and os.path.lexists(entry["dest"]):
+            placed = threading.Event()
+            placed.set()
+            dedup["kept"].setdefault(
+                entry["sop_uid"],
+                {"item": item, "dest": entry["dest"], "hash": None, "placed": placed},
+            )
+            dedup["dests"][entry["dest"]] = entry["sop_uid"]
+    return dedup
+
+
+def collision_dest(dest: str, sop_uid: str):
+    """
+    Destination for an instance whose file name is already taken by a
+    different instance in the same series, the SOPInstanceUID is appended
+    """
+    stem, ext = os.path.splitext(dest)
+    return f"{stem}-{sop_uid}{ext}"
+
+
+def claim_instance(entry: dict, dedup: dict):
+    """
+    Register a plan_file() entry as the copy of its instance that is kept,
+    unless another file with the same SOPInstanceUID was registered first.
+    A destination already claimed by a different instance (same file name in
+    the same series) is renamed with the SOPInstanceUID appended.
+
+    Returns
+    -------
+    kept instance dict if entry is a duplicate, otherwise None
+    """
+    sop_uid = entry["sop_uid"]
+    item = os.path.abspath(entry["item"])
+    with dedup["lock"]:
+        kept = dedup["kept"].get(sop_uid)
+        if sop_uid and kept is not None and kept["item"] != item:
+            return kept
+        claimed = dedup["dests"].get(entry["dest"])
+        if claimed is not None and claimed != sop_uid:
+            entry["dest"] = collision_dest(entry["dest"], sop_uid)
+        if sop_uid:
+            dedup["kept"][sop_uid] = {
+                "item": item,
+                "dest": entry["dest"],
+                "hash": None,
+                "placed": threading.Event(),
+            }
+        dedup["dests"][entry["dest"]] = sop_uid
+    return None
+
+
+def place_unique(
+    entry: dict, created: set, dedup: dict, mode="copy", journal=None, metrics=None
+):
+    """
+    Place a plan_file() entry unless the same instance was already placed.
+    Duplicates are skipped (their destination is recorded as the kept copy)
+    or hardlinked to the kept copy, depending on dedup["mode"]. With
+    dedup["verify"] a file whose content differs from the kept copy is not a
+    duplicate but a conflict, it is placed under a name with its hash appended.
+
+    Returns
+    -------
+    place_entry() result, with "duplicate_of" (kept source path) for duplicates
+    """
+    kept = claim_instance(entry, dedup)
+    if kept is None:
+        try:
+            return place_entry(entry, created, mode, journal, metrics)
+        finally:
+            if entry["sop_uid"]:
+                dedup["kept"][entry["sop_uid"]]["placed"].set()
+    # the kept copy may still be being placed by another thread
+    kept["placed"].wait()
+    entry["place_bytes_read"] = 0
+    if dedup["verify"]:
+        if kept["hash"] is None:
+            # the placed copy differs from its source when de-identified
+            kept_path = kept["item"] if os.path.exists(kept["item"]) else kept["dest"]
+            kept["hash"] = file_hash(kept_path)
+            entry["place_bytes_read"] += os.path.getsize(kept_path)
+        digest = file_hash(entry["item"])
+        entry["place_bytes_read"] += entry["file_size"]
+        if digest != kept["hash"]:
+            with dedup["lock"]:
+                dedup["conflicts"].append(entry["item"])
+            stem, ext = os.path.splitext(entry["dest"])
+            entry["dest"] = f"{stem}-{digest[:12]}{ext}"
+            hashed = entry["place_bytes_read"]
+            place_entry(entry, created, mode, journal, metrics)
+            entry["place_bytes_read"] += hashed
+            return entry
+    with dedup["lock"]:
+        dedup["duplicates"].setdefault(entry["sop_uid"], [kept["item"]]).append(
+            entry["item"]
+        )
+    entry["duplicate_of"] = kept["item"]
+    entry["bytes_written"] = 0
+    if dedup["mode"] == "hardlink" and entry["dest"] != kept["dest"]:
+        with timed(metrics, "mkdir"):
+            make_folder(os.path.dirname(entry["dest"]), created)
+        with timed(metrics, "place"):
+            entry["placement"] = place_file(kept["dest"], entry["dest"], "hardlink")
+        if entry["placement"] == "copy":
+            entry["bytes_written"] = entry["file_size"]
+            entry["place_bytes_read"] += entry["file_size"]
+    else:
+        entry["dest"] = kept["dest"]
+        entry["placement"] = "skip"
+    return entry
+
+
+def new_metrics():
+    """
+    Counters and stage timings of a run, updated by the worker threads.
+    Stage times are summed over all threads, so with several workers they
+    can add up to more than the elapsed time.
+
+    Returns
+    -------
+    {"lock", "start": perf_counter at creation, "seconds": {"listing", "parse",
+    "mkdir", "place"}, "files": int, "skipped": int, "failed": int,
+    "header_bytes_read": int, "place_bytes_read": int, "bytes_written": int,
+    "errors": {exception type: [{"item", "message"}]}}
+    header_bytes_read counts the headers parsed, place_bytes_read the source
+    bytes read while placing (copies, de-identification and hash verification)
+    """
+    return {
+        "lock": threading.Lock(),
+        "start": time.perf_counter(),
+        "seconds": {"listing": 0.0, "parse": 0.0, "mkdir": 0.0, "place": 0.0},
+        "files": 0,
+        "skipped": 0,
+        "failed": 0,
+        "header_bytes_read": 0,
+        "place_bytes_read": 0,
+        "bytes_written": 0,
+        "errors": {},
+    }
+
+
+def progress_line(metrics: dict):
+    """
+    One line summary of a running organize for a live progress display
+    """
+    elapsed = max(time.perf_counter() - metrics["start"], 1e-6)
+    bytes_read = metrics["header_bytes_read"] + metrics["place_bytes_read"]
+    return (
+        f"{metrics['files']} items, {metrics['files'] / elapsed:.1f} items/s, "
+        f"read {format_bytes(bytes_read)} ({format_bytes(bytes_read / elapsed)}/s), "
+        f"wrote {format_bytes(metrics['bytes_written'])} "
+        f"({format_bytes(metrics['bytes_written'] / elapsed)}/s), "
+        f"{metrics['skipped']} skipped, {metrics['failed']} failed"
+    )
+
+
+def metrics_report(metrics: dict):
+    """
+    Machine readable summary of a run's metrics, see new_metrics()
+
+    Returns
+    -------
+    dict with elapsed seconds, counts, rates (items/s, MB/s read and written),
+    stage seconds and errors by exception type. bytes_read and
+    mb_per_second_read include headers and placement, header_bytes_read and
+    place_bytes_read split them
+    """
+    elapsed = max(time.perf_counter() - metrics["start"], 1e-6)
+    mb = 1024 * 1024
+    bytes_read = metrics["header_bytes_read"] + metrics["place_bytes_read"]
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "files": metrics["files"],
+        "skipped": metrics["skipped"],
+        "failed": metrics["failed"],
+        "files_per_second": round(metrics["files"] / elapsed, 2),
+        "bytes_read": bytes_read,
+        "header_bytes_read": metrics["header_bytes_read"],
+        "place_bytes_read": metrics["place_bytes_read"],
+        "bytes_written": metrics["bytes_written"],
+        "mb_per_second_read": round(bytes_read / mb / elapsed, 3),
+        "mb_per_second_written": round(metrics["bytes_written"] / mb / elapsed, 3),
+        "stage_seconds": {x: round(y, 3) for x, y in metrics["seconds"].items()},
+        "errors": metrics["errors"],
+    }
+
+
+def organize_files(
+    files,
+    dest_dir: str,
+    workers: int = 1,
+    mode: str = "copy",
+    journal=None,
+    allow_no_preamble: bool = False,
+    dedup=None,
+    deid: str = None,
+    metrics=None,
+):
+    """
+    Organize dicom files into series folders in dest_dir. With workers > 1
+    header parsing and copying are overlapped in a thread pool. files may be
+    a generator, it is consumed as files are organized.
+
+    Parameters
+    ----------
+    files : list or iterable of file paths
+    dest_dir : destination folder
+    workers : number of worker threads (1 = run in the calling thread)
+    mode : placement mode, see place_file()
+    journal : optional journal from open_journal()
+    allow_no_preamble : also accept dicom files without preamble, see sniff_dicom()
+    dedup : optional state from new_dedup() to skip or link duplicate instances
+    deid : optional de-identification profile, see deid_profiles
+    metrics : optional metrics from new_metrics(), updated as files are done
+
+    Returns
+    -------
+    (results, failed_contents, skipped)
+    results : list of dicts returned by organize_file for each success
+    failed_contents : list of file paths that could not be organized
+    skipped : dict of {reason: [file paths]} for files rejected as not dicom
+    """
+    # destinations are recorded in the manifest, keep them independent of the cwd
+    dest_dir = os.path.abspath(dest_dir)
+    created = set()
+
+    def run(item):
+        return organize_file(
+            item,
+            dest_dir,
+            created,
+            mode,
+            journal,
+            allow_no_preamble,
+            dedup,
+            deid,
+            metrics,
+        )
+
+    return collect_results(run, files, workers, metrics)
+
+
+def collect_results(func, items, workers: int = 1, metrics: dict = None):
+    """
+    Run func (organize_file, plan_file, ...) over items and sort the outcomes.
+    Errors raised by func are reported with their exception type and, with
+    metrics from new_metrics(), collected in metrics["errors"] by type.
+
+    Returns
+    -------
+    (results, failed_contents, skipped)
+    results : list of result dicts for each success
+    failed_contents : list of items func raised an error for
+    skipped : dict of {reason: [items]} for results with a "skipped" reason
+    """
+    results = []
+    failed_contents = []
+    skipped = {}
+
+    def run(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return {"item": item, "error": type(e).__name__, "message": str(e)}
+
+    for item, result in bounded_map(run, items, workers):
+        # items are plan entries when applying a plan
+        path = item["item"] if isinstance(item, dict) else item
+        if "error" in result:
+            print(f"{result['error']} with item: {path}: {result['message']}")
+            failed_contents.append(item)
+        elif "skipped" in result:
+            skipped.setdefault(result["skipped"], []).append(item)
+        else:
+            results.append(result)
+        if metrics is None:
+            continue
+        with metrics["lock"]:
+            if "error" in result:
+                metrics["failed"] += 1
+                metrics["errors"].setdefault(result["error"], []).append(
+                    {"item": path, "message": result["message"]}
+                )
+            elif "skipped" in result:
+                metrics["skipped"] += 1
+            else:
+                metrics["files"] += 1
+                metrics["header_bytes_read"] += result["bytes_read"]
+                metrics["place_bytes_read"] += result.get("place_bytes_read", 0)
+                metrics["bytes_written"] += result.get("bytes_written", 0)
+    return results, failed_contents, skipped
+
+
+def plan_files(
+    files,
+    dest_dir: str,
+    workers: int = 1,
+    allow_no_preamble=False,
+    deid=None,
+    metrics=None,
+):
+    """
+    Read the headers of dicom files and build the organize plan for dest_dir
+    without touching it. See build_plan() for the plan contents.
+
+    Parameters
+    ----------
+    files : list or iterable of file paths
+    dest_dir : destination folder the plan is made for
+    workers : number of threads reading headers
+    allow_no_preamble : also accept dicom files without preamble, see sniff_dicom()
+    deid : optional de-identification profile applied when the plan is applied
+    metrics : optional metrics from new_metrics()
+    """
+    dest_dir = os.path.abspath(dest_dir)
+    files = (os.path.abspath(item) for item in files)
+
+    def run(item):
+        with timed(metrics, "parse"):
+            return plan_file(item, dest_dir, allow_no_preamble, deid)
+
+    entries, failed_contents, skipped = collect_results(run, files, workers, metrics)
+    return build_plan(dest_dir, entries, failed_contents, skipped)
+
+
+def build_plan(dest_dir: str, entries: list, failed_contents: list, skipped: dict):
+    """
+    Summarize plan_file() entries into an organize plan
+
+    Returns
+    -------
+    {"dest_dir": str, "files": int, "bytes": int, "series": {folder: {"instances",
+    "bytes"}}, "collisions": {dest: [items]}, "existing": [dests],
+    "duplicates": {sop_uid: [items]}, "failed": [items],
+    "skipped": {reason: [items]}, "entries": [plan_file() dicts]}
+    collisions are destinations planned for more than one source file,
+    existing are destinations that already exist and would be replaced,
+    duplicates are instances (SOPInstanceUID) found in more than one file
+    """
+    series = {}
+    sources = {}
+    instances = {}
+    for entry in entries:
+        instances.setdefault(entry["sop_uid"], []).append(entry["item"])
+        counts = series.setdefault(entry["series"], {"instances": 0, "bytes": 0})
+        counts["instances"] += 1
+        counts["bytes"] += entry["file_size"]
+        sources.setdefault(entry["dest"], []).append(entry["item"])
+    return {
+        "dest_dir": dest_dir,
+        "files": len(entries),
+        "bytes": sum(entry["file_size"] for entry in entries),
+        "series": series,
+        "collisions": {
+            dest: items for dest, items in sources.items() if len(items) > 1
+        },
+        "existing": [dest for dest in sources if os.path.lexists(dest)],
+        "duplicates": {
+            sop_uid: items
+            for sop_uid, items in instances.items()
+            if sop_uid and len(items) > 1
+        },
+        "failed": failed_contents,
+        "skipped": skipped,
+        "entries": entries,
+    }
+
+
+def save_plan(plan_path: str, plan: dict):
+    """
+    Write a plan to plan_path as json, and one line per file to a csv file
+    next to it (same name with .csv) for review in a spreadsheet
+    """
+    with open(plan_path, "w") as f:
+        json.dump(plan, f, indent=1)
+    csv_path = f"{os.path.splitext(plan_path)[0]}.csv"
+    columns = ["item", "dest", "series", "file_size", "sop_uid"]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(plan["entries"])
+    return csv_path
+
+
+def load_plan(plan_path: str):
+    """
+    Load a plan written by save_plan()
+    """
+    with open(plan_path, "r") as f:
+        return json.load(f)
+
+
+def apply_plan(
+    plan: dict,
+    workers: int = 1,
+    mode: str = "copy",
+    journal=None,
+    dedup=None,
+    metrics=None,
+):
+    """
+    Place the files of a plan in parallel. Source files that changed since
+    the plan was made are not placed, missing source files count as failed.
+    Different instances planned for the same destination (collisions) are kept
+    apart by appending the SOPInstanceUID, the same as organizing with dedup.
+
+    Parameters
+    ----------
+    plan : plan from plan_files() or load_plan()
+    workers : number of threads placing files
+    mode : placement mode, see place_file()
+    journal : optional journal from open_journal()
+    dedup : optional state from new_dedup() to skip or link duplicate instances
+    metrics : optional metrics from new_metrics()
+
+    Returns
+    -------
+    (results, failed_contents, changed)
+    results : list of place_entry() results, with bytes_read 0 and the header
+    bytes read when the plan was made in plan_bytes_read
+    failed_contents : list of source paths that could not be placed
+    changed : list of source paths that changed since the plan was made
+    """
+    created = set()
+    entries = [dict(entry) for entry in plan["entries"]]
+    for entry in entries:
+        # headers were read when the plan was made, applying reads none
+        entry["plan_bytes_read"] = entry["bytes_read"]
+        entry["bytes_read"] = 0
+    if dedup is None:
+        # with dedup place_unique() renames colliding destinations
+        claimed = {}
+        for entry in entries:
+            sop_uid = claimed.setdefault(entry["dest"], entry["sop_uid"])
+            if sop_uid != entry["sop_uid"]:
+                entry["dest"] = collision_dest(entry["dest"], entry["sop_uid"])
+                claimed[entry["dest"]] = entry["sop_uid"]
+
+    def run(entry):
+        stat = os.stat(entry["item"])
+        if stat.st_size != entry["file_size"] or stat.st_mtime_ns != entry["mtime"]:
+            return {"item": entry["item"], "skipped": "changed since plan"}
+        if dedup is not None:
+            return place_unique(entry, created, dedup, mode, journal, metrics)
+        return place_entry(entry, created, mode, journal, metrics)
+
+    results, failed, skipped = collect_results(run, entries, workers, metrics)
+    failed_contents = [entry["item"] for entry in failed]
+    changed = [entry["item"] for entry in skipped.get("changed since plan", [])]
+    return results, failed_contents, changed
+
+
+def organize_bytes(data: bytes, dest_dir: str, created: set):
+    """
+    Place an encoded dicom file held in memory (i.e. received over the network)
+    into its series folder. The bytes are written unchanged, the image is named
+    after its SOPInstanceUID.
+
+    Parameters
+    ----------
+    data : encoded dicom file including preamble and file meta information
+    dest_dir : destination folder for the series folders
+    created : set of folders already created during this run
+
+    Returns
+    -------
+    dest : path the file was written to
+    """
+    img = pydicom.dcmread(
+        io.BytesIO(data), stop_before_pixels=True, specific_tags=organize_tags
+    )
+    foldername, imagename = series_names(img, f"{img.SOPInstanceUID}.dcm")
+    folderpath = os.path.join(os.path.abspath(dest_dir), foldername)
+    make_folder(folderpath, created)
+    dest = os.path.join(folderpath, imagename)
+    temp_path = temp_name(dest)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return dest
+
+
+def spool_bytes(data: bytes, dest_dir: str):
+    """
+    Write an encoded dicom file received over the network to the incoming
+    folder of dest_dir and flush it to disk, so it survives a crash or restart
+    once the sender was told it was stored. See organize_spooled().
+
+    Returns
+    -------
+    path the file was written to
+    """
+    folderpath = os.path.join(os.path.abspath(dest_dir), incoming_folder)
+    os.makedirs(folderpath, exist_ok=True)
+    dest = os.path.join(folderpath, f"{uuid.uuid4().hex}.dcm")
+    temp_path = temp_name(dest)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return dest
+
+
+def spooled_files(dest_dir: str):
+    """
+    Images left in the incoming folder of dest_dir by a receiver that stopped
+    before organizing them. Partially written files (never acknowledged to the
+    sender) are removed.
+
+    Returns
+    -------
+    list of paths, oldest first
+    """
+    folderpath = os.path.join(os.path.abspath(dest_dir), incoming_folder)
+    if not os.path.isdir(folderpath):
+        return []
+    paths = []
+    for entry in os.scandir(folderpath):
+        if entry.name.endswith(".part"):
+            os.remove(entry.path)
+        elif entry.is_file():
+            paths.append(entry.path)
+    return sorted(paths, key=os.path.getmtime)
+
+
+def organize_spooled(path: str, dest_dir: str, created: set):
+    """
+    Move an image written by spool_bytes() into its series folder, named after
+    its SOPInstanceUID the same as organize_bytes(). The spooled file is renamed
+    into place, so the image is not written a second time.
+
+    Returns
+    -------
+    dest : path the file was moved to
+    """
+    img = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=organize_tags)
+    foldername, imagename = series_names(img, f"{img.SOPInstanceUID}.dcm")
+    folderpath = os.path.join(os.path.abspath(dest_dir), foldername)
+    make_folder(folderpath, created)
+    dest = os.path.join(folderpath, imagename)
+    os.replace(path, dest)
+    return dest
+
+
+def save_failed_spooled(path: str, dest_dir: str):
+    """
+    Move a spooled image that could not be organized to the failed folder of
+    dest_dir, see save_failed_bytes()
+
+    Returns
+    -------
+    path the file was moved to
+    """
+    folderpath = os.path.join(os.path.abspath(dest_dir), failed_folder)
+    os.makedirs(folderpath, exist_ok=True)
+    dest = os.path.join(folderpath, os.path.basename(path))
+    os.replace(path, dest)
+    return dest
+
+
+def save_failed_bytes(data: bytes, dest_dir: str):
+    """
+    Keep an encoded dicom file that could not be organized (i.e. received over
+    the network without SeriesInstanceUID) unchanged in the failed folder of
+    dest_dir, so it is not lost after the sender was told it was stored
+
+    Returns
+    -------
+    path the file was written to
+    """
+    folderpath = os.path.join(os.path.abspath(dest_dir), failed_folder)
+    os.makedirs(folderpath, exist_ok=True)
+    dest = os.path.join(folderpath, f"{uuid.uuid4().hex}.dcm")
+    temp_path = temp_name(dest)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return dest
+
+
+def load_manifest(dest_dir: str):
+    """
+    Load the organize manifest from dest_dir. Runs only append their entries,
+    the file is rewritten without replaced entries (compacted) here once it has
+    grown to more than twice the number of source files.
+
+    Returns
+    -------
+    manifest : dict of {source path: {"size", "mtime", "sop_uid", "dest", "slice",
+    "image"}},
+    empty if no manifest exists yet
+    """
+    path = os.path.join(dest_dir, manifest_name)
+    manifest = {}
+    if not os.path.exists(path):
+        return manifest
+    lines = 0
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # last line may be cut off if a run was killed mid-write
+                continue
+            manifest[entry.pop("item")] = entry
+            lines += 1
+    if lines > 2 * len(manifest) + 1000:
+        save_manifest(dest_dir, manifest)
+    return manifest
+
+
+def save_manifest(dest_dir: str, manifest: dict):
+    """
+    Write the whole organize manifest to dest_dir, replacing the previous one
+    atomically. Runs use append_manifest(), this is only needed for compacting.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, manifest_name)
+    temp_path = temp_name(path)
+    with open(temp_path, "w") as f:
+        for item, entry in manifest.items():
+            f.write(json.dumps({"item": item, **entry}) + "\n")
+    os.replace(temp_path, path)
+
+
+def append_manifest(dest_dir: str, entries: dict):
+    """
+    Append manifest entries ({source path: entry}, see update_manifest()) to
+    the manifest file in dest_dir, so saving costs the files of the run rather
+    than the whole archive
+    """
+    if len(entries) == 0:
+        return
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, manifest_name)
+    with open(path, "a") as f:
+        for item, entry in entries.items():
+            f.write(json.dumps({"item": item, **entry}) + "\n")
+
+
+def update_manifest(manifest: dict, results: list):
+    """
+    Record the organize_file results of a run in the manifest
+
+    Returns
+    -------
+    dict of {source path: entry} added or replaced, for append_manifest() and
+    index_series()
+    """
+    entries = {}
+    for result in results:
+        entries[os.path.abspath(result["item"])] = {
+            "size": result["file_size"],
+            "mtime": result["mtime"],
+            "sop_uid": result["sop_uid"],
+            "dest": os.path.abspath(result["dest"]),
+            "slice": result.get("slice"),
+            "image": result.get("image"),
+        }
+    manifest.update(entries)
+    return entries
+
+
+def index_series(series_index: dict, entries: dict):
+    """
+    Add manifest entries ({source path: entry}) to a series index of
+    {series folder: {source path: None}}, so the instances of a folder are
+    found without scanning the whole manifest
+    """
+    for item, entry in entries.items():
+        series_index.setdefault(os.path.dirname(entry["dest"]), {})[item] = None
+    return series_index
+
+
+def series_entries(manifest: dict, folders, series_index: dict = None):
+    """
+    Manifest entries of the instances placed in each of folders (including by
+    earlier runs). With a series_index from index_series() only the entries of
+    those folders are looked at, otherwise the whole manifest is scanned.
+
+    Returns
+    -------
+    dict of {folder: [manifest entries]}
+    """
+    if series_index is None:
+        series_index = index_series({}, manifest)
+    found = {}
+    for folder in set(folders):
+        for item in series_index.get(folder, {}):
+            entry = manifest.get(item)
+            # entries that were organized again into another folder moved on
+            if entry is not None and os.path.dirname(entry["dest"]) == folder:
+                found.setdefault(folder, []).append(entry)
+    return found
+
+
+def is_unchanged(item: str, manifest: dict):
+    """
+    True if the manifest has an entry for item with the same size and
+    modification time and the destination file still exists. A file removed
+    since it was listed counts as changed, organizing it then reports it as
+    failed instead of stopping the run.
+    """
+    entry = manifest.get(os.path.abspath(item))
+    if entry is None:
+        return False
+    try:
+        stat = os.stat(item)
+    except FileNotFoundError:
+        return False
+    return (
+        entry["size"] == stat.st_size
+        and entry["mtime"] == stat.st_mtime_ns
+        and os.path.lexists(entry["dest"])
+    )
+
+
+def filter_unchanged(files: list, manifest: dict):
+    """
+    Split files into those that need organizing and those already organized,
+    see is_unchanged()
+
+    Returns
+    -------
+    (to_process, unchanged) : lists of file paths
+    """
+    to_process = []
+    unchanged = []
+    for item in files:
+        if is_unchanged(item, manifest):
+            unchanged.append(item)
+        else:
+            to_process.append(item)
+    return to_process, unchanged
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024):
+    """
+    sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_journal(dest_dir: str, resume: bool = False):
+    """
+    Open the write-ahead journal in dest_dir. Each placement is appended as a
+    "plan" line before the file is placed and a "done" line afterwards, so a
+    killed run leaves a record of exactly which files were finished.
+
+    Parameters
+    ----------
+    dest_dir : destination folder
+    resume : keep the existing journal and append to it instead of starting a new one
+
+    Returns
+    -------
+    journal : {"file": open journal file, "lock": threading.Lock}
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, journal_name)
+    return {
+        "file": open(path, "a" if resume else "w"),
+        "lock": threading.Lock(),
+    }
+
+
+def journal_record(journal: dict, op: str, result: dict):
+    """
+    Append a "plan" or "done" record for an organize_file result to the journal
+    """
+    line = json.dumps({"op": op, **result})
+    with journal["lock"]:
+        journal["file"].write(line + "\n")
+        journal["file"].flush()
+
+
+def close_journal(journal: dict, dest_dir: str):
+    """
+    Close the journal and remove it. Call once the run has been recorded in
+    the manifest, after that the journal is no longer needed for resuming.
+    """
+    journal["file"].close()
+    os.remove(os.path.join(dest_dir, journal_name))
+
+
+def replay_journal(dest_dir: str):
+    """
+    Read the journal left by an interrupted run and verify its placements.
+    "done" files are checked to exist with the recorded size. Files that were
+    planned but not marked done are accepted only if the destination matches
+    the source by size and sha256 hash.
+
+    Returns
+    -------
+    (completed, redo)
+    completed : list of organize_file results verified as placed
+    redo : list of source paths that were planned or done but failed verification
+    """
+    path = os.path.join(dest_dir, journal_name)
+    if not os.path.exists(path):
+        return [], []
+    planned = {}
+    done = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # last line may be cut off if the run was killed mid-write
+                continue
+            op = record.pop("op")
+            if op == "plan":
+                planned[record["item"]] = record
+            else:
+                done[record["item"]] = record
+    completed = []
+    redo = []
+    for item, record in done.items():
+        dest = record["dest"]
+        size = record.get("dest_size", record["file_size"])
+        if os.path.lexists(dest) and os.path.getsize(dest) == size:
+            completed.append(record)
+        else:
+            redo.append(item)
+    for item, record in planned.items():
+        if item in done:
+            continue
+        dest = record["dest"]
+        if not os.path.exists(dest) or os.path.getsize(dest) != record["file_size"]:
+            redo.append(item)
+        elif os.path.exists(item) and file_hash(item) != file_hash(dest):
+            redo.append(item)
+        else:
+            record["placement"] = "resumed"
+            record["bytes_written"] = 0
+            completed.append(record)
+    return completed, redo
+
+
+def write_series_summaries(manifest: dict, folders, series_index: dict = None):
+    """
+    Write series_summary.json into each series folder in folders, built from
+    the manifest entries of the instances placed in that folder (including
+    instances placed by earlier runs), see series_entries()
+
+    Returns
+    -------
+    dict of {folder: summary}, see series_summary()
+    """
+    instances = {}
+    for folder, entries in series_entries(manifest, folders, series_index).items():
+        for entry in entries:
+            # duplicates skipped by --dedup share the destination of the kept copy,
+            # hardlinked duplicates have their own name but the same SOPInstanceUID
+            key = entry.get("sop_uid") or entry["dest"]
+            instances.setdefault(folder, {})[key] = entry.get("slice")
+    summaries = {}
+    for folder, slices in instances.items():
+        summary = series_summary(list(slices.values()))
+        path = os.path.join(folder, summary_name)
+        temp_path = temp_name(path)
+        with open(temp_path, "w") as f:
+            json.dump(summary, f, indent=1)
+        os.replace(temp_path, path)
+        summaries[folder] = summary
+    return summaries
+
+
+def write_series_manifests(manifest: dict, folders, series_index: dict = None):
+    """
+    Write series_manifest.json into each series folder in folders, listing
+    every instance placed in the folder (including by earlier runs) with its
+    file name, SliceLocation, SliceThickness, ImagePositionPatient and the
+    fields of image_info(), so loaders can pick slices without parsing files.
+    Each instance (SOPInstanceUID) is listed once, the names of further copies
+    in the folder (hardlinked by --dedup hardlink) are listed in its
+    "duplicates". See series_entries() for series_index.
+
+    Returns
+    -------
+    dict of {folder: number of instances listed}
+    """
+    instances = {}
+    for folder, entries in series_entries(manifest, folders, series_index).items():
+        for entry in entries:
+            key = entry.get("sop_uid") or entry["dest"]
+            rows = instances.setdefault(folder, {})
+            name = os.path.basename(entry["dest"])
+            if key in rows:
+                if name != rows[key]["file"] and name not in rows[key]["duplicates"]:
+                    rows[key]["duplicates"].append(name)
+                continue
+            slice_geometry = entry.get("slice") or {}
+            rows[key] = {
+                "file": os.path.basename(entry["dest"]),
+                "SliceLocation": slice_geometry.get("location"),
+                "SliceThickness": slice_geometry.get("thickness"),
+                "ImagePositionPatient": slice_geometry.get("position"),
+                **(entry.get("image") or {}),
+                "duplicates": [],
+            }
+    counts = {}
+    for folder, rows in instances.items():
+        rows = sorted(
+            rows.values(),
+            key=lambda x: (x["SliceLocation"] is None, x["SliceLocation"] or 0),
+        )
+        path = os.path.join(folder, series_manifest_name)
+        temp_path = temp_name(path)
+        with open(temp_path, "w") as f:
+            json.dump({"instances": rows}, f, indent=1)
+        os.replace(temp_path, path)
+        counts[folder] = len(rows)
+    return counts
+
+
+def check_settled(pending: dict, paths, settle: float, now: float):
+    """
+    Debounce files that may still be being written. Each path is stat'ed and its
+    size and mtime compared with the last check. A file is ready once neither has
+    changed for `settle` seconds, ready files are removed from pending.
+
+    Parameters
+    ----------
+    pending : dict of {path: (size, mtime, time of last change)}, updated in place
+    paths : paths with new activity, pending paths are always checked again
+    settle : seconds a file must stay unchanged
+    now : current time.monotonic()
+
+    Returns
+    -------
+    ready : list of paths that have settled
+    """
+    for path in set(paths) | set(pending):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed or renamed before it settled
+            pending.pop(path, None)
+            continue
+        key = (stat.st_size, stat.st_mtime_ns)
+        entry = pending.get(path)
+        if entry is None or entry[:2] != key:
+            pending[path] = (*key, now)
+    ready = [path for path, entry in pending.items() if now - entry[2] >= settle]
+    for path in ready:
+        del pending[path]
+    return ready
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool to receive dicom images over the network (C-STORE SCP) and
+place each one into a folder named by its series description and series UID
+as soon as it arrives, using the same layout as organize_cmd.py
+
+Received images are written to an incoming folder in dest before the sender
+is told they are stored, and a pool of worker threads moves them into their
+series folders from a bounded queue. Images still in the incoming folder when
+the receiver stops or crashes are organized on the next start. Requires
+pynetdicom.
+
+"""
+import os
+import sys
+import argparse
+import time
+import queue
+import signal
+import threading
+from pynetdicom import AE, evt, AllStoragePresentationContexts, ALL_TRANSFER_SYNTAXES
+from pynetdicom.sop_class import Verification
+
+# add path for importing organizefunctions.py
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import organizefunctions
+
+parser = argparse.ArgumentParser(
+    description="Receive DICOM images and separate them by series UID on arrival",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "dest", help="destination folder to save newly organized image folders"
+)
+parser.add_argument(
+    "--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 for all"
+)
+parser.add_argument("--port", type=int, default=11112, help="port to listen on")
+parser.add_argument("--ae-title", default="ORGANIZE", help="AE title of this receiver")
+parser.add_argument(
+    "--workers", type=int, default=4, help="number of threads writing images"
+)
+parser.add_argument(
+    "--queue-size",
+    type=int,
+    default=500,
+    help="max number of received images waiting to be written",
+)
+parser.add_argument(
+    "--queue-timeout",
+    type=float,
+    default=30,
+    help="seconds to wait for space in a full queue before refusing an image",
+)
+parser.add_argument(
+    "--no-spool",
+    action="store_true",
+    help="keep received images in memory until they are written instead of "
+    "writing them to dest/incoming before acknowledging them. Saves one flushed "
+    "write per image, but images still queued are lost if the receiver crashes "
+    "or is killed (they are written on ctrl+c or SIGTERM)",
+)
+args = parser.parse_args()
+
+config = vars(args)
+dest_dir = os.path.abspath(config["dest"])
+os.makedirs(dest_dir, exist_ok=True)
+
+work = queue.Queue(maxsize=config["queue_size"])
+created = set()
+counts = {"received": 0, "written": 0, "failed": 0, "refused": 0}
+counts_lock = threading.Lock()
+
+
+def handle_store(event):
+    """
+    C-STORE handler, queues the encoded image without decoding it. Unless
+    --no-spool is used the image is on disk in dest/incoming before success
+    is returned, the queue then only holds its path.
+    """
+    data = event.encoded_dataset()
+    if not config["no_spool"]:
+        try:
+            data = organizefunctions.spool_bytes(data, dest_dir)
+        except OSError as e:
+            print(f"error spooling received image: {type(e).__name__}: {e}")
+            with counts_lock:
+                counts["refused"] += 1
+            return 0xA700
+    try:
+        work.put(data, timeout=config["queue_timeout"])
+    except queue.Full:
+        if not config["no_spool"]:
+            os.remove(data)
+        with counts_lock:
+            counts["refused"] += 1
+        return 0xA700  # out of resources, the sender can retry later
+    with counts_lock:
+        counts["received"] += 1
+    return 0x0000
+
+
+def write_worker():
+    while True:
+        data = work.get()
+        try:
+            if isinstance(data, str):
+                organizefunctions.organize_spooled(data, dest_dir, created)
+            else:
+                organizefunctions.organize_bytes(data, dest_dir, created)
+            with counts_lock:
+                counts["written"] += 1
+        except Exception as e:
+            # the sender was already told the image is stored, keep the bytes
+            try:
+                if isinstance(data, str):
+                    kept = organizefunctions.save_failed_spooled(data, dest_dir)
+                else:
+                    kept = organizefunctions.save_failed_bytes(data, dest_dir)
+                print(
+                    f"error organizing received image: {type(e).__name__}: {e}, "
+                    f"saved as {kept}"
+                )
+            except Exception as e2:
+                print(
+                    f"error organizing received image: {type(e).__name__}: {e}, "
+                    f"could not save it: {type(e2).__name__}: {e2}"
+                )
+            with counts_lock:
+                counts["failed"] += 1
+        finally:
+            work.task_done()
+
+
+for i in range(max(config["workers"], 1)):
+    threading.Thread(target=write_worker, daemon=True).start()
+
+# images received but not organized before the last run stopped
+spooled = organizefunctions.spooled_files(dest_dir)
+if len(spooled) > 0:
+    print(f"organizing {len(spooled)} images received before the last stop")
+    for path in spooled:
+        work.put(path)
+
+
+def stop(signum, frame):
+    """
+    stop on SIGTERM the same as on ctrl+c, so queued images are written
+    """
+    raise KeyboardInterrupt
+
+
+signal.signal(signal.SIGTERM, stop)
+
+ae = AE(ae_title=config["ae_title"])
+for context in AllStoragePresentationContexts:
+    ae.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES)
+ae.add_supported_context(Verification)
+
+print(
+    f"listening as {config['ae_title']} on {config['host']}:{config['port']}, "
+    f"saving to {dest_dir} (ctrl+c to stop)"
+)
+server = ae.start_server(
+    (config["host"], config["port"]),
+    block=False,
+    evt_handlers=[(evt.EVT_C_STORE, handle_store)],
+)
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    pass
+finally:
+    server.shutdown()
+    # finish writing everything that was received
+    work.join()
+    print(
+        f"received {counts['received']} images, wrote {counts['written']}, "
+        f"failed {counts['failed']}, refused {counts['refused']}"
+    )
+    if counts["failed"] > 0:
+        failed_path = os.path.join(dest_dir, organizefunctions.failed_folder)
+        print(f"images that could not be organized are in {failed_path}")
+    print(f"check destination folder: {dest_dir}")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Command line tool that keeps watching source folders and organizes new dicom
+files into folders named by series description and series UID as they arrive,
+using the same layout and manifest as organize_cmd.py
+
+File system events are used when the watchdog package is installed (inotify on
+linux), otherwise the source folders are polled. Files are only organized once
+their size and modification time have stopped changing.
+
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+# add path for importing organizefunctions.py
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+import organizefunctions
+
+parser = argparse.ArgumentParser(
+    description="Watch folders and separate new DICOM files by series UID",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("src", nargs="+", help="source folders to watch")
+parser.add_argument(
+    "dest", help="destination folder to save newly organized image folders"
+)
+parser.add_argument(
+    "--workers", type=int, default=4, help="number of worker threads per batch"
+)
+parser.add_argument(
+    "--mode",
+    choices=organizefunctions.placement_modes,
+    default="copy",
+    help="how to place files in the destination, falls back to copy if the mode fails",
+)
+parser.add_argument(
+    "--settle",
+    type=float,
+    default=5,
+    help="seconds a file must be unchanged before it is organized",
+)
+parser.add_argument(
+    "--interval", type=float, default=2, help="seconds between checks for new files"
+)
+parser.add_argument(
+    "--poll",
+    action="store_true",
+    help="poll the source folders even if file system events are available",
+)
+args = parser.parse_args()
+
+config = vars(args)
+dest_dir = os.path.abspath(config["dest"])
+src_dirs = [os.path.abspath(x) for x in config["src"]]
+manifest = organizefunctions.load_manifest(dest_dir)
+# instances of each series folder, so a batch only revisits the folders it touched
+series_index = organizefunctions.index_series({}, manifest)
+
+
+def stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def list_files():
+    return list(organizefunctions.walk_files(src_dirs))
+
+
+# paths reported by file system events since the last check
+events = set()
+events_lock = threading.Lock()
+observer = None
+if Observer is not None and not config["poll"]:
+
+    class EventHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            with events_lock:
+                events.add(event.src_path)
+                if getattr(event, "dest_path", ""):
+                    events.add(event.dest_path)
+
+    observer = Observer()
+    for src in src_dirs:
+        observer.schedule(EventHandler(), src, recursive=True)
+    observer.start()
+    print("watching for file system events...")
+else:
+    print(f"polling source folders every {config['interval']} seconds...")
+
+# files already in the source folders are checked against the manifest first
+pending = {}
+# non-DICOM and failed files, not retried until their size or mtime changes
+rejected = {}
+candidates = list_files()
+organized = 0
+try:
+    while True:
+        candidates = [
+            x
+            for x in candidates
+            if os.path.isfile(x) and (x not in rejected or rejected[x] != stat_key(x))
+        ]
+        files, unchanged = organizefunctions.filter_unchanged(candidates, manifest)
+        ready = organizefunctions.check_settled(
+            pending, files, config["settle"], time.monotonic()
+        )
+        if len(ready) > 0:
+            journal = organizefunctions.open_journal(dest_dir)
+            results, failed_contents, skipped = organizefunctions.organize_files(
+                ready,
+                dest_dir,
+                workers=config["workers"],
+                mode=config["mode"],
+                journal=journal,
+            )
+            entries = organizefunctions.update_manifest(manifest, results)
+            organizefunctions.append_manifest(dest_dir, entries)
+            organizefunctions.close_journal(journal, dest_dir)
+            organizefunctions.index_series(series_index, entries)
+            folders = {os.path.dirname(x["dest"]) for x in results}
+            organizefunctions.write_series_summaries(manifest, folders, series_index)
+            organizefunctions.write_series_manifests(manifest, folders, series_index)
+            organized += len(results)
+            for item in failed_contents + [x for y in skipped.values() for x in y]:
+                rejected[item] = stat_key(item)
+            print(
+                f"{time.strftime('%H:%M:%S')} organized {len(results)} items, "
+                f"failed {len(failed_contents)}, "
+                f"skipped {sum(len(x) for x in skipped.values())} non-DICOM items"
+            )
+        time.sleep(config["interval"])
+        if observer is not None:
+            with events_lock:
+                candidates = list(events)
+                events.clear()
+        else:
+            candidates = list_files()
+except KeyboardInterrupt:
+    pass
+finally:
+    if observer is not None:
+        observer.stop()
+        observer.join()
+    print(f"organized {organized} items, check destination folder: {dest_dir}")
@@ -22,6 +22,8 @@ from pretty_html_table import build_table
 import re
 import zipfile
 import shutil
+import json
+import threading
 import base64
 import io
 from jinja2 import Template
@@ -29,6 +31,20 @@ import ipywidgets as widgets
 from datetime import datetime
 import csv
 
+# add path for importing dicomfiles.py, shared with the other tools
+sys.path.insert(
+    1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common")
+)
+from dicomfiles import (
+    sniff_header,
+    sniff_dicom,
+    read_errors,
+    walk_files,
+    bounded_map,
+    summary_name,
+    series_summary,
+)
+
 
 def test_print():
     print("ctfunctions.py connected and working")
@@ -293,7 +309,8 @@ def handle_compression(file):
 
 def local_unzip_contents(zip_path, unzip_path):
     """
-    Search zip_path for zip files and then extract them to new folders with same name as original zip in unzip_path
+    Search zip_path for zip files and then extract them to new folders with same name as original zip in unzip_path.
+    Extracting is not needed for local_separate_name_images, which reads zip files directly.
 
     Paramaters
     ----
@@ -343,95 +360,481 @@ def local_unzip_contents(zip_path, unzip_path):
 # newdirpaths = [os.path.join(unzip_path,d) for d in newdirs]
 
 
-def local_separate_name_images(src_path, dest_path):
+def read_journal(journal_path: str):
+    """
+    Read a write-ahead journal left by local_separate_name_images
+
+    Parameters
+    ----------
+    journal_path : path to separate_journal.jsonl
+
+    Returns
+    -------
+    completed : dict of {output file path: size} for every write marked done
+    whose output file still exists with the recorded size
+    """
+    completed = {}
+    if not os.path.exists(journal_path):
+        return completed
+    with open(journal_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # last line may be cut off if the run was killed mid-write
+                continue
+            if record["op"] != "done":
+                continue
+            dest = record["dest"]
+            if os.path.exists(dest) and os.path.getsize(dest) == record["size"]:
+                completed[dest] = record["size"]
+    return completed
+
+
+def print_skipped(skipped: dict, failed: dict = None):
+    """
+    Print counts of files rejected by sniff_dicom, skipped is {reason: count}, and
+    the files that looked like DICOM but could not be read, failed is
+    {reason: [file names]}
+    """
+    for reason, count in skipped.items():
+        print(f"skipped {count} non-DICOM files: {reason}")
+    for reason, names in (failed or {}).items():
+        print(f"failed to read {len(names)} files: {reason}")
+        pprint.pp(names)
+
+
+def iter_dicom_files(
+    files, stop_before_pixels=False, allow_no_preamble=False, workers=1
+):
+    """
+    Read files with pydicom, yielding (path, pydicom.dataset.FileDataset)
+    for each valid DICOM file. Files rejected by sniff_dicom are counted and skipped
+    without being parsed, files that cannot be read are counted by error and listed
+    when the files are done.
+    With stop_before_pixels=True only the header of each file is read.
+    files may be a generator (i.e. walk_files), with workers > 1 files are read in a
+    thread pool while the generator is still producing paths.
+    """
+    skipped = {}
+    failed = {}
+
+    def read(file):
+        try:
+            reason = sniff_dicom(file, allow_no_preamble)
+            if reason is not None:
+                return reason
+            return pydicom.dcmread(
+                file, stop_before_pixels=stop_before_pixels, force=allow_no_preamble
+            )
+        except read_errors as e:
+            return e
+
+    for file, img in bounded_map(read, files, workers):
+        if isinstance(img, str):
+            skipped[img] = skipped.get(img, 0) + 1
+        elif isinstance(img, Exception):
+            failed.setdefault(type(img).__name__, []).append(file)
+        else:
+            yield file, img
+    print_skipped(skipped, failed)
+
+
+def iter_zip_dicom(zip_file_path: str, workers=4, stop_before_pixels=False):
+    """
+    Parse DICOM files directly from the members of a zip archive, without extracting
+    the archive to disk. Members are read and parsed in parallel worker threads,
+    each with its own handle on the archive.
+
+    Parameters
+    ----------
+    zip_file_path : path to zip file
+    workers : number of worker threads
+    stop_before_pixels : only parse the header of each member, reading it as a stream
+
+    Returns
+    -------
+    generator of (member name, pydicom.dataset.FileDataset) for each valid DICOM member,
+    the dataset filename is set to "<zip_file_path>::<member name>". Members rejected by
+    sniff_header are counted and skipped without being parsed, members that cannot be
+    read are counted by error and listed when the archive is done.
+    """
+    local = threading.local()
+    handles = []
+
+    def read_member(info):
+        if not hasattr(local, "zip"):
+            local.zip = zipfile.ZipFile(zip_file_path, "r")
+            handles.append(local.zip)
+        try:
+            if stop_before_pixels:
+                with local.zip.open(info) as stream:
+                    reason = sniff_header(info.filename, stream.read(132))
+                    if reason is not None:
+                        return reason
+                    stream.seek(0)
+                    img = pydicom.dcmread(stream, stop_before_pixels=True)
+            else:
+                data = local.zip.read(info)
+                reason = sniff_header(info.filename, data[:132])
+                if reason is not None:
+                    return reason
+                img = pydicom.dcmread(io.BytesIO(data))
+        except (zipfile.BadZipFile, *read_errors) as e:
+            return e
+        img.filename = f"{zip_file_path}::{info.filename}"
+        return img
+
+    with zipfile.ZipFile(zip_file_path, "r") as zipref:
+        members = [info for info in zipref.infolist() if not info.is_dir()]
+    skipped = {}
+    failed = {}
+    try:
+        for info, img in bounded_map(read_member, members, workers=workers):
+            if isinstance(img, str):
+                skipped[img] = skipped.get(img, 0) + 1
+            elif isinstance(img, Exception):
+                failed.setdefault(type(img).__name__, []).append(info.filename)
+            else:
+                yield info.filename, img
+    finally:
+        for handle in handles:
+            handle.close()
+    print_skipped(skipped, failed)
+
+
+def header_record(path: str, img, member=None):
+    """
+    Lightweight record of the header fields needed for separating a series, so that
+    full datasets don't need to be held in memory while grouping and sorting.
+
+    Parameters
+    ----------
+    path : path to DICOM file, or to the zip file containing it
+    img : pydicom dataset (header only is enough)
+    member : name of the zip member if the image is inside a zip file
+
+    Returns
+    -------
+    SimpleNamespace with path, member, SeriesInstanceUID, SeriesDescription, SliceLocation,
+    SliceThickness, ImagePositionPatient and info (series manifest row, see manifest_row)
+    """
+    return SimpleNamespace(
+        path=path,
+        member=member,
+        SeriesInstanceUID=img.SeriesInstanceUID,
+        SeriesDescription=img.get("SeriesDescription", ""),
+        SliceLocation=img.SliceLocation,
+        SliceThickness=img.get("SliceThickness"),
+        ImagePositionPatient=img.get("ImagePositionPatient"),
+        info=manifest_row(None, img),
+    )
+
+
+def read_record_image(record, zipref=None):
+    """
+    Fully read the DICOM image described by a header_record
+
+    Parameters
+    ----------
+    record : SimpleNamespace from header_record
+    zipref : open zipfile.ZipFile, required if the record points to a zip member
+
+    Returns
+    -------
+    pydicom.dataset.FileDataset
+    """
+    if record.member is not None:
+        return pydicom.dcmread(io.BytesIO(zipref.read(record.member)))
+    return pydicom.dcmread(record.path)
+
+
+def group_series(records: list):
+    """
+    Group images into series by SeriesInstanceUID in a single pass over a dict of
+    series buckets. Series are ordered by their first slice in SliceLocation order,
+    images within each series are sorted by SliceLocation.
+
+    Parameters
+    ----------
+    records : list of header_record or pydicom datasets with SeriesInstanceUID,
+    SeriesDescription and SliceLocation
+
+    Returns
+    -------
+    [{"uid": str, "description": str, "images": list}, ...]
+    """
+    groups = {}
+    for record in sorted(records, key=lambda s: s.SliceLocation):
+        uid = record.SeriesInstanceUID
+        if uid not in groups:
+            description = getattr(record, "SeriesDescription", "") or "_"
+            groups[uid] = {"uid": uid, "description": description, "images": []}
+        groups[uid]["images"].append(record)
+    return list(groups.values())
+
+
+# file in each separated series folder listing its instances, see manifest_row
+series_manifest_name = "series_manifest.json"
+
+# header fields recorded for each instance in the series manifest
+manifest_fields = [
+    "SliceLocation",
+    "SliceThickness",
+    "ImagePositionPatient",
+    "Rows",
+    "Columns",
+    "PixelSpacing",
+    "RescaleSlope",
+    "RescaleIntercept",
+]
+
+
+def manifest_row(file_name, img):
+    """
+    Series manifest entry for one image: file name, manifest_fields and TransferSyntaxUID
+
+    Parameters
+    ----------
+    file_name : name of the image file in its series folder
+    img : pydicom dataset (header only is enough)
+    """
+    row = {"file": file_name}
+    for keyword in manifest_fields:
+        value = img.get(keyword)
+        if value is None or value == "":
+            row[keyword] = None
+        elif isinstance(value, pydicom.multival.MultiValue):
+            row[keyword] = [float(x) for x in value]
+        elif isinstance(value, int):
+            row[keyword] = int(value)
+        else:
+            row[keyword] = float(value)
+    row["TransferSyntaxUID"] = str(img.file_meta.get("TransferSyntaxUID", ""))
+    return row
+
+
+def write_series_manifest(folderpath: str, rows: list):
+    """
+    Write manifest_row entries of the images in a series folder to series_manifest.json
+    """
+    write_json(os.path.join(folderpath, series_manifest_name), {"instances": rows})
+
+
+def read_series_manifest(series_path: str):
+    """
+    Read series_manifest.json of a series folder (written by the organizers and
+    separators)
+
+    Returns
+    -------
+    list of manifest rows with "path" added, or None if the folder has no manifest,
+    a listed file no longer exists or the folder holds files the manifest does not
+    list (a stale or partial manifest)
+    """
+    path = os.path.join(series_path, series_manifest_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        rows = json.load(f)["instances"]
+    files = [
+        x.name
+        for x in os.scandir(series_path)
+        if x.is_file()
+        and not x.name.startswith(".")
+        and x.name not in (summary_name, series_manifest_name)
+    ]
+    # copies of an instance (i.e. hardlinked duplicates) are listed with the instance
+    listed = len(rows) + sum(len(x.get("duplicates", [])) for x in rows)
+    if len(files) != listed:
+        print(
+            f"{series_manifest_name} lists {listed} of {len(files)} files "
+            f"in {series_path}, reading all files"
+        )
+        return None
+    for row in rows:
+        row["path"] = os.path.join(series_path, row["file"])
+        if not os.path.exists(row["path"]):
+            return None
+    return rows
+
+
+def record_slice(record):
+    """
+    Slice geometry of a header_record or pydicom dataset in the form used by
+    series_summary() (the slice_info() of organizefunctions.py)
+    """
+    location = getattr(record, "SliceLocation", None)
+    position = getattr(record, "ImagePositionPatient", None)
+    thickness = getattr(record, "SliceThickness", None)
+    return {
+        "location": float(location) if location not in (None, "") else None,
+        "position": [float(x) for x in position] if position else None,
+        "thickness": float(thickness) if thickness not in (None, "") else None,
+    }
+
+
+def write_json(path: str, data):
     """
-    Searches source path for folders, parses each folder to find dicom images.
+    Write data to a json file under a temporary name and rename it into place, so a
+    killed run never leaves a partial file
+    """
+    temp_path = f"{path}.part"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def write_series_summary(folderpath: str, records: list):
+    """
+    Write the series_summary() of records (header_record or pydicom datasets) to
+    series_summary.json in folderpath
+    """
+    summary = series_summary([record_slice(x) for x in records])
+    write_json(os.path.join(folderpath, summary_name), summary)
+    return summary
+
+
+def check_series_summary(series_path: str, min_extent=120):
+    """
+    Check a series folder for problems recorded in its series_summary.json (written by
+    the organizers and separators) before any image is decoded. The ACR phantom needs
+    slices covering at least min_extent mm to locate all four modules.
+
+    Parameters
+    ----------
+    series_path : path to series folder
+    min_extent : smallest distance in mm between first and last slice
+
+    Returns
+    -------
+    list of problems, empty if the series looks complete or has no summary
+    """
+    path = os.path.join(series_path, summary_name)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        summary = json.load(f)
+    problems = list(summary["problems"])
+    if summary["extent"] < min_extent:
+        problems.append(
+            f"slices cover {summary['extent']}mm, at least {min_extent}mm are needed"
+        )
+    return problems
+
+
+def series_ready(series_path: str, min_extent=120, skip_incomplete=False):
+    """
+    Print the problems check_series_summary() finds for a series folder and decide
+    whether to process it. By default a series with problems is processed after a
+    warning (i.e. a series without slice positions may still be usable), with
+    skip_incomplete=True it is skipped.
+
+    Returns
+    -------
+    True if the series should be processed
+    """
+    problems = check_series_summary(series_path, min_extent)
+    if len(problems) == 0:
+        return True
+    if skip_incomplete:
+        print(f"Skipping incomplete series {series_path}: {', '.join(problems)}")
+        return False
+    print(f"Warning, series may be incomplete {series_path}: {', '.join(problems)}")
+    return True
+
+
+def copy_record_bytes(record, dest: str, zipref=None):
+    """
+    Copy the original bytes of the DICOM image described by a header_record to dest,
+    without parsing or decoding the dataset
+
+    Parameters
+    ----------
+    record : SimpleNamespace from header_record
+    dest : destination file path
+    zipref : open zipfile.ZipFile, required if the record points to a zip member
+    """
+    if record.member is not None:
+        with zipref.open(record.member) as fsrc, open(dest, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    else:
+        shutil.copyfile(record.path, dest)
+
+
+def local_separate_name_images(src_path, dest_path, resume=False, decompress=True):
+    """
+    Searches source path for folders and zip files, parses each folder to find dicom images.
+    Zip files are read member by member without extracting them first.
     Creates new folder for each series, places images named with SliceLocation in each series folder
+
+    Images are handled in two passes so memory use doesn't grow with series size: headers are
+    read first to group and sort lightweight records, then each image is read, written and
+    released one at a time.
+
+    Every write is recorded in dest_path/separate_journal.jsonl. If a run is interrupted,
+    call again with resume=True to skip images the journal shows were already written.
+
+    With decompress=False the original file bytes are placed unchanged instead of decoding
+    compressed pixel data and rewriting the dataset. get_slices decompresses these images
+    when they are loaded for processing.
     """
     # generate timestamp for unique naming purposes
     timestamp = datetime.today().strftime("%Y%m%d%H%M%S")
-    # list folders found in source_path
+    # write-ahead journal of planned and completed image writes
+    os.makedirs(dest_path, exist_ok=True)
+    journal_path = os.path.join(dest_path, "separate_journal.jsonl")
+    completed = read_journal(journal_path) if resume else {}
+    if len(completed) > 0:
+        print(f"resuming, {len(completed)} images already written...")
+    journal = open(journal_path, "a" if resume else "w")
+    # list folders and zip files found in source_path
     imgdirs = [
         dirname
         for dirname in os.listdir(src_path)
         if os.path.isdir(os.path.join(src_path, dirname))
+        or (
+            dirname.lower().endswith(".zip")
+            and zipfile.is_zipfile(os.path.join(src_path, dirname))
+        )
     ]
 
     for folderindex, imgdir in enumerate(imgdirs):
-        # list all files down the folder tree
-        all_files = [
-            os.path.join(dirpath, f)
-            for (dirpath, dirnames, filenames) in os.walk(
-                os.path.join(src_path, imgdir)
+        source = os.path.join(src_path, imgdir)
+        if os.path.isdir(source):
+            # walk the folder tree while headers are read, nothing waits for the full listing
+            print("reading folder:", imgdir)
+            images = iter_dicom_files(
+                walk_files([source]), stop_before_pixels=True, workers=4
             )
-            for f in filenames
-        ]
+            zipref = None
+        else:
+            # parse zip members directly, output folder is named after the zip
+            print("reading zip file:", imgdir)
+            images = iter_zip_dicom(source, stop_before_pixels=True)
+            zipref = zipfile.ZipFile(source, "r")
+            imgdir = os.path.splitext(imgdir)[0]
 
         files_to_process = []
 
-        # add files found to be valid dicom to files_to_process
-        print("found", len(all_files), "files in folder:", imgdir)
+        # first pass: add header records of files found to be valid dicom to files_to_process
         decompress_count = 0
-        for file in all_files:
-            try:
-                img = pydicom.dcmread(file)
-                if isinstance(img, pydicom.dicomdir.DicomDir):
-                    print("Excluding DicomDir:", file)
-                elif not hasattr(img, "SliceLocation"):
-                    print(
-                        os.path.basename(file),
-                        " has no SliceLocation attribute, skipping...",
-                    )
-                else:
-                    img = handle_compression(img)
-                    files_to_process.append(img)
-                    decompress_count = decompress_count + 1
-            except pydicom.InvalidDicomError:
-                print(f"invalid DICOM error:{file}...")
-            except:
-                pass
-        if decompress_count > 0:
-            print(f"Decompressed {decompress_count} files...")
-        print("found", len(files_to_process), "DICOM files to process...")
-
-        # sort by slice location
-        files_to_process = sorted(files_to_process, key=lambda s: s.SliceLocation)
-
-        uids = []
-        descriptions = []
-        tuples = []
-
-        for slice in files_to_process:
-            # generate list of unique values for series instance uid
-            if slice.SeriesInstanceUID not in uids:
-                uids.append(slice.SeriesInstanceUID)
-            # generate list of unique values for series description
-            if hasattr(slice, "SeriesDescription"):
-                if slice.SeriesDescription not in descriptions:
-                    descriptions.append(slice.SeriesDescription)
-            # generate list of tuple(series uid, description, dicom image)
-            tuples.append(
-                (slice.SeriesInstanceUID, slice.SeriesDescription or "_", slice)
-            )
-        # blank list for adding entries of (UID, description, [images])
-        groups = []
-
-        # If number of series instances is equal to number of series descriptions, add both to new item:
-        for i in range(0, len(uids)):
-            groups.append((uids[i], [], []))
-        for group in groups:
-            group_uid = group[0]
-            for tuple in tuples:
-                if tuple[0] == group_uid:
-                    group[2].append(tuple[2])
-        dicts = []
-        for item in groups:
-            if len(item) == 3:
-                dicts.append(
-                    {"uid": item[0], "description": item[1], "images": item[2]}
+        for file, img in images:
+            if isinstance(img, pydicom.dicomdir.DicomDir):
+                print("Excluding DicomDir:", file)
+            elif not hasattr(img, "SliceLocation"):
+                print(
+                    os.path.basename(file),
+                    " has no SliceLocation attribute, skipping...",
                 )
+            elif zipref is not None:
+                files_to_process.append(header_record(source, img, member=file))
             else:
-                dicts.append({"uid": item[0], "description": "_", "images": item[1]})
+                files_to_process.append(header_record(file, img))
+        print("found", len(files_to_process), "DICOM files to process...")
+
+        # group into series, each sorted by slice location
+        dicts = group_series(files_to_process)
 
         for idx, entry in enumerate(dicts):
             descr = pydash.kebab_case(entry["description"])
@@ -441,14 +844,63 @@ def local_separate_name_images(src_path, dest_path):
             if not os.path.exists(folderpath):
                 print(f"Creating folder {folderpath}")
                 os.makedirs(folderpath)
+            summary = write_series_summary(folderpath, entry["images"])
+            if not summary["complete"]:
+                print(
+                    f"Warning, series may be incomplete: {', '.join(summary['problems'])}"
+                )
             imgcount = 0
-            for idx, img in enumerate(entry["images"]):
+            skipcount = 0
+            rows = []
+            for idx, record in enumerate(entry["images"]):
                 filepath = os.path.join(
-                    folderpath, f"Image{idx}_loc{img.SliceLocation}"
+                    folderpath, f"Image{idx}_loc{record.SliceLocation}"
                 )
-                pydicom.dcmwrite(filepath, img)
+                row = dict(record.info, file=os.path.basename(filepath))
+                rows.append(row)
+                if filepath in completed:
+                    # may have been decompressed, take the transfer syntax from the written file
+                    written = pydicom.dcmread(filepath, stop_before_pixels=True)
+                    row["TransferSyntaxUID"] = str(written.file_meta.TransferSyntaxUID)
+                    skipcount += 1
+                    continue
+                journal.write(json.dumps({"op": "plan", "dest": filepath}) + "\n")
+                journal.flush()
+                # second pass: read one full image at a time
+                src_file = record.path
+                if record.member is not None:
+                    src_file = f"{record.path}::{record.member}"
+                # write to a temporary name so a killed run never leaves a partial image
+                temp_path = f"{filepath}.part"
+                if decompress:
+                    img = read_record_image(record, zipref)
+                    img = handle_compression(img)
+                    decompress_count = decompress_count + 1
+                    row["TransferSyntaxUID"] = str(img.file_meta.TransferSyntaxUID)
+                    pydicom.dcmwrite(temp_path, img)
+                else:
+                    # no rewrite needed, copy the original bytes
+                    copy_record_bytes(record, temp_path, zipref)
+                os.replace(temp_path, filepath)
+                done_record = {
+                    "op": "done",
+                    "src": src_file,
+                    "dest": filepath,
+                    "size": os.path.getsize(filepath),
+                }
+                journal.write(json.dumps(done_record) + "\n")
+                journal.flush()
                 imgcount += 1
+            write_series_manifest(folderpath, rows)
             print(f"Added {imgcount} images")
+            if skipcount > 0:
+                print(f"Skipped {skipcount} images written by previous run")
+        if zipref is not None:
+            zipref.close()
+        if decompress_count > 0:
+            print(f"Decompressed {decompress_count} files...")
+    journal.close()
+    os.remove(journal_path)
 
 
 def unzip_and_separate(zip_path: str, unzip_path: str):
@@ -456,8 +908,9 @@ def unzip_and_separate(zip_path: str, unzip_path: str):
     Search the contents of a zip file for valid DICOM images, skips over images
     without SliceLocation attribute (like scout localizers), and then separates all images into
     folders based on their series description or series uid. Individual image files are renamed
-    by an index and the SliceLocation of the image. Original unzipped contents are placed in /unzip_path/unzipped/
-    and newly separated and named images are placed in /unzip_path/new/
+    by an index and the SliceLocation of the image. The zip is read member by member with
+    iter_zip_dicom, nothing is extracted to disk. Newly separated and named images are placed
+    in /unzip_path/new/
 
     Parameters
     ----------
@@ -487,38 +940,27 @@ def unzip_and_separate(zip_path: str, unzip_path: str):
             if os.path.exists(unzip_path):
                 shutil.rmtree(unzip_path)
             os.mkdir(unzip_path)
-            if zipfile.is_zipfile(zip_path):
-                with zipfile.ZipFile(zip_path, "r") as zipref:
-                    zipref.extractall(f"{unzip_path}unzipped")
-                    print("unzipping...")
-
             files = []
 
-            list = [
-                os.path.join(dirpath, f)
-                for (dirpath, dirnames, filenames) in os.walk(unzip_path)
-                for f in filenames
-            ]
-
-            for file in list:
-                try:
-                    read = pydicom.dcmread(file)
+            # first pass: read headers only, keeping lightweight records of each image
+            if zipfile.is_zipfile(zip_path):
+                print("reading zip file...")
+                for name, read in iter_zip_dicom(zip_path, stop_before_pixels=True):
                     if isinstance(read, pydicom.dicomdir.DicomDir):
-                        print("Excluding:", file)
+                        print("Excluding:", name)
                     else:
-                        files.append(read)
-                except:
-                    pass
+                        files.append((name, read))
             print("found DICOM files:", len(files))
             slices = []
 
             # identify slices like localizers that don't have SliceLocation and skip them
             skipcount = 0
-            for f in files:
+            for name, f in files:
                 if hasattr(f, "SliceLocation"):
-                    slices.append(f)
+                    slices.append(header_record(zip_path, f, member=name))
                 else:
                     skipcount = skipcount + 1
+            files = []
             if skipcount > 0:
                 print(
                     "skipped",
@@ -526,76 +968,37 @@ def unzip_and_separate(zip_path: str, unzip_path: str):
                     "slices due to absence of SliceLocation attribute...",
                 )
 
-            slices = sorted(slices, key=lambda s: s.SliceLocation)
-
-            if hasattr(slices[0], "InstitutionName"):
-                name = slices[0].InstitutionName
-            else:
-                name = slices[0].InstiutionCodeSequence
-            # name = pydash.capitalize(pydash.camel_case(name), strict=False)
-            # date = pydash.camel_case(slices[0].StudyDate)
-            # model =  pydash.capitalize(pydash.camel_case(slices[0].ManufacturerModelName), strict=False)
-            # namestring = f"{date}_{name}_{model}_images"
-            uids = []
-            descriptions = []
-            tuples = []
-
-            for slice in slices:
-                # generate list of unique values for series instance uid
-                if slice.SeriesInstanceUID not in uids:
-                    uids.append(slice.SeriesInstanceUID)
-                # generate list of unique values for series description
-                if hasattr(slice, "SeriesDescription"):
-                    if slice.SeriesDescription not in descriptions:
-                        descriptions.append(slice.SeriesDescription)
-                # generate list of (series uid, description, dicom image)
-                tuples.append((slice.SeriesInstanceUID, slice.SeriesDescription, slice))
-            # blank list for adding entries of (UID, description, [images])
-            groups = []
-
-            # If number of series instances is equal to number of series descriptions, add both to new item:
-
-            for i in range(0, len(uids)):
-                if len(uids) == len(descriptions):
-                    # add (uid, description, blank list)
-                    groups.append((uids[i], descriptions[i], []))
-                else:
-                    groups.append((uids[i], descriptions[i], []))
-            for group in groups:
-                group_uid = group[0]
-                for tuple in tuples:
-                    if tuple[0] == group_uid:
-                        group[2].append(tuple[2])
-
-            # print(len(groups[3][2]))
-            dicts = []
-            for item in groups:
-                if len(item) == 3:
-                    dicts.append(
-                        {"uid": item[0], "description": item[1], "images": item[2]}
-                    )
-                else:
-                    dicts.append(
-                        {"uid": item[0], "description": "_", "images": item[1]}
-                    )
+            # group into series, each sorted by slice location
+            dicts = group_series(slices)
 
             destpath = f"{unzip_path}new"
             if os.path.exists(destpath):
                 shutil.rmtree(destpath)
             os.mkdir(destpath)
 
+            # second pass: read, write and release one image at a time
+            zipref = zipfile.ZipFile(zip_path, "r")
             for idx, entry in enumerate(dicts):
                 descr = pydash.kebab_case(entry["description"])
                 foldername = f"{idx}-{descr}"
                 folderpath = f"{destpath}/{foldername}"
                 print(f"Creating folder {folderpath}")
                 os.mkdir(folderpath)
+                summary = write_series_summary(folderpath, entry["images"])
+                if not summary["complete"]:
+                    print(
+                        f"Warning, series may be incomplete: {', '.join(summary['problems'])}"
+                    )
                 imgcount = 0
-                for idx, img in enumerate(entry["images"]):
-                    filepath = f"{folderpath}/Image{idx}_loc{img.SliceLocation}"
-                    pydicom.dcmwrite(filepath, img)
+                rows = []
+                for idx, record in enumerate(entry["images"]):
+                    filepath = f"{folderpath}/Image{idx}_loc{record.SliceLocation}"
+                    rows.append(dict(record.info, file=os.path.basename(filepath)))
+                    pydicom.dcmwrite(filepath, read_record_image(record, zipref))
                     imgcount += 1
+                write_series_manifest(folderpath, rows)
                 print(f"Added {imgcount} images")
+            zipref.close()
 
             shutil.make_archive("Separated-Named-Images", "zip", destpath)
             print(
@@ -603,28 +1006,103 @@ def unzip_and_separate(zip_path: str, unzip_path: str):
             )
 
 
-def load_multiple_dicom(path: str):
+def load_multiple_dicom(path: str, allow_no_preamble=False):
     """
     path: path to a directory containing DICOM images
+    allow_no_preamble: also read DICOM files without preamble and "DICM" prefix
     --
-    Takes path string of folder containing only DICOM files with any extension \n
-    remove dicomdir, other files first.
+    Takes path string of folder containing DICOM files with any extension \n
+    DICOMDIR and non-DICOM files are skipped by checking the first bytes of each file.
     Returns a list of pydicom.dataset.FileDataset
     """
     if os.path.exists(path):
         files = []
+        skipped = {}
         for fname in glob.glob(f"{path}/*", recursive=True):
-            file = pydicom.dcmread(fname)
+            if not os.path.isfile(fname) or os.path.basename(fname) in [
+                summary_name,
+                series_manifest_name,
+            ]:
+                continue
+            reason = sniff_dicom(fname, allow_no_preamble)
+            if reason is not None:
+                skipped[reason] = skipped.get(reason, 0) + 1
+                continue
+            file = pydicom.dcmread(fname, force=allow_no_preamble)
             files.append(file)
+        print_skipped(skipped)
         return files
     else:
         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
 
 
+class ManifestSlice:
+    """
+    Slice of a series folder listed in its series_manifest.json, used by get_slices
+    like a pydicom dataset. The manifest_fields (SliceLocation, SliceThickness,
+    PixelSpacing, rescale values...) come from the manifest row, other header elements
+    are read from the file (without Pixel Data) the first time one is used. Pixel
+    data is read, decompressed and rotated each time pixel_array is used and not
+    kept, so only the slices that are looked at are decoded and memory does not grow
+    with the size of the series.
+    """
+
+    def __init__(self, row: dict, rotate_angle=0):
+        self.row = row
+        self.path = row["path"]
+        self.rotate_angle = rotate_angle
+        self.header = None
+
+    def dataset(self):
+        """
+        Header of the image file without Pixel Data, read on first use
+        """
+        if self.header is None:
+            self.header = pydicom.dcmread(self.path, stop_before_pixels=True)
+        return self.header
+
+    @property
+    def pixel_array(self):
+        img = pydicom.dcmread(self.path)
+        stx = self.row.get("TransferSyntaxUID") or img.file_meta.get(
+            "TransferSyntaxUID", ""
+        )
+        # images separated without decompression are decompressed when used
+        if any(x["uid"] == stx and x["compressed"] for x in transfer_syntaxes):
+            img = handle_compression(img) or img
+        pixels = img.pixel_array
+        if self.rotate_angle != 0:
+            pixels = rotate(pixels, angle=self.rotate_angle, reshape=False)
+        return pixels
+
+    def __getattr__(self, name):
+        # only reached for names that are not set in __init__
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name in manifest_fields and self.row.get(name) is not None:
+            return self.row[name]
+        return getattr(self.dataset(), name)
+
+    def __contains__(self, key):
+        return key in self.dataset()
+
+    def __iter__(self):
+        return iter(self.dataset())
+
+    def __getitem__(self, key):
+        return self.dataset()[key]
+
+
 def get_slices(source_path: str, rotate_angle=0):
     """
     Search a folder of DICOM images, extract those with SliceLocation attribute, sorted by SliceLocation
 
+    If the folder has a series_manifest.json the slices are selected and sorted using
+    the SliceLocation it lists, without opening any file. The slices are returned as
+    ManifestSlice objects, which only read a file when a header element missing from
+    the manifest or the pixels of that slice are used, and decompress and rotate the
+    pixels at that point.
+
     Parameters
     ----------
     source_path : path to directory containing DICOM images
@@ -632,9 +1110,15 @@ def get_slices(source_path: str, rotate_angle=0):
 
     Returns
     -------
-    slices : list of pydicom.dataset.FileDataset
+    slices : list of pydicom.dataset.FileDataset (or ManifestSlice)
 
     """
+    rows = read_series_manifest(source_path)
+    if rows is not None:
+        rows = [row for row in rows if row["SliceLocation"] is not None]
+        rows = sorted(rows, key=lambda x: x["SliceLocation"])
+        return [ManifestSlice(row, rotate_angle) for row in rows]
+
     files = load_multiple_dicom(
         source_path
     )  # slices is a list of pydicom.dataset.FileDataset
@@ -644,6 +1128,10 @@ def get_slices(source_path: str, rotate_angle=0):
     skipcount = 0
     for f in files:
         if hasattr(f, "SliceLocation"):
+            # images separated without decompression are decompressed when loaded
+            stx = f.file_meta.get("TransferSyntaxUID", "")
+            if any(x["uid"] == stx and x["compressed"] for x in transfer_syntaxes):
+                f = handle_compression(f)
             slices.append(f)
         else:
             skipcount = skipcount + 1
@@ -2428,7 +2916,13 @@ def local_select_series(src_path: str, series: list):
         print("No folders labeled 'Series...' found in source directory...")
 
 
-def process_images(image_directory: str, report_directory: str, series: list[str]):
+def process_images(
+    image_directory: str,
+    report_directory: str,
+    series: list[str],
+    min_extent=120,
+    skip_incomplete=False,
+):
     """
     Process ACR phantom images for series names found in `series` list. Calls `process_phantom()`
     for each series. Reports are generated in appropriate reports directories. Finally
@@ -2439,11 +2933,16 @@ def process_images(image_directory: str, report_directory: str, series: list[str
     image_directory: str -> path to extracted images directory (i.e. images/new/)
     report_directory: str -> path to reports directory
     series : list[str] -> list of strings corresponding to names of image series folders
+    min_extent : smallest distance in mm between first and last slice, see
+    check_series_summary()
+    skip_incomplete : skip series with problems instead of warning, see series_ready()
 
     """
     for item in series:
         if item.value == True:
             seriespath = os.path.join(image_directory, item.description)
+            if not series_ready(seriespath, min_extent, skip_incomplete):
+                continue
             slices = get_slices(seriespath)
             print("")
             slice_coords = get_slice_coordinates(slices)
@@ -2538,7 +3037,12 @@ def local_process_phantom(
 
 
 def local_process_images(
-    report_directory: str, series: list[str], with_pdf=False, path_to_wkhtmltopdf=""
+    report_directory: str,
+    series: list[str],
+    with_pdf=False,
+    path_to_wkhtmltopdf="",
+    min_extent=120,
+    skip_incomplete=False,
 ):
     """
     Process ACR phantom images for series names found in `series` list. Calls `process_phantom()`
@@ -2549,12 +3053,17 @@ def local_process_images(
     ---------
     report_directory: str -> path to directory for placing reports
     series : list[str] -> list of strings corresponding to paths image series folders
+    min_extent : smallest distance in mm between first and last slice, see
+    check_series_summary()
+    skip_incomplete : skip series with problems instead of warning, see series_ready()
 
     """
     # try:
     for item in series:
         if item.value == True:
             seriespath = item.description
+            if not series_ready(seriespath, min_extent, skip_incomplete):
+                continue
             slices = get_slices(seriespath)
             slice_coords = get_slice_coordinates(slices)
             local_process_phantom(
@@ -2587,6 +3096,8 @@ def process_single_series_folder(
     report_directory: str,
     with_pdf=False,
     path_to_wkhtmltopdf="",
+    min_extent=120,
+    skip_incomplete=False,
 ):
     """
     Process ACR phantom images for series names found in `series` list. Calls `process_phantom()`
@@ -2597,11 +3108,16 @@ def process_single_series_folder(
     ---------
     report_directory: str -> path to directory for placing reports
     series : list[str] -> list of strings corresponding to paths image series folders
+    min_extent : smallest distance in mm between first and last slice, see
+    check_series_summary()
+    skip_incomplete : skip series with problems instead of warning, see series_ready()
 
     """
     try:
         print("processing phantom images...")
         seriespath = image_folder_path
+        if not series_ready(seriespath, min_extent, skip_incomplete):
+            return
         slices = get_slices(seriespath)
         slice_coords = get_slice_coordinates(slices)
         local_process_phantom(
@@ -5,11 +5,67 @@ Created on Tue Nov  7 15:41:25 2023
 """
 
 import os
+import sys
 import shutil
+import uuid
 import pydicom
 import tkinter
 from tkinter import filedialog
 
+# add path for importing dicomfiles.py, shared with the other tools
+sys.path.insert(
+    1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+)
+from dicomfiles import sniff_dicom
+
+# header elements needed to organize, everything else (including Pixel Data) is skipped
+organize_tags = [0x0020000E, 0x0008103E]  # SeriesInstanceUID, SeriesDescription
+
+# how images are placed in the organized folders, one of:
+# "copy", "hardlink", "symlink", "move" or "reflink" (copy-on-write clone).
+# If the selected mode is not possible for a file it is copied instead.
+placement_mode = "copy"
+
+# also accept dicom files saved without the 128 byte preamble and "DICM" prefix
+allow_no_preamble = False
+
+
+def place_file(src, dst, mode=placement_mode):
+    """
+    Place src at dst with the selected placement mode, falling back to a copy.
+    Files are created under a temporary name and renamed into place. A move that
+    falls back to a copy removes src once the copy is in place.
+    Returns the mode used, "copy" when the selected mode was not possible.
+    """
+    temp_path = os.path.join(
+        os.path.dirname(dst), f".{os.path.basename(dst)}.{uuid.uuid4().hex[:12]}.part"
+    )
+    used = mode
+    try:
+        if mode == "move":
+            shutil.move(src, temp_path)
+        elif mode == "hardlink":
+            os.link(src, temp_path)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), temp_path)
+        elif mode == "reflink":
+            import fcntl
+
+            with open(src, "rb") as fsrc, open(temp_path, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), 0x40049409, fsrc.fileno())  # FICLONE
+        else:
+            shutil.copyfile(src, temp_path)
+    except (OSError, ImportError):
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        shutil.copyfile(src, temp_path)
+        used = "copy"
+    os.replace(temp_path, dst)
+    if mode == "move" and used == "copy" and os.path.lexists(src):
+        os.remove(src)
+    return used
+
+
 root = tkinter.Tk()
 root.wm_attributes("-topmost", 1)
 root.withdraw()  # use to hide tkinter window
@@ -38,20 +94,41 @@ try:
         contents = []
         failed_contents = []
         success_contents = []
+        skipped_contents = {}
         message = ""
         folderpath = ""
+        bytes_read = 0
+        bytes_total = 0
+        fallback_count = 0
         for item in dcms:
             try:
-                img = pydicom.dcmread(item)
+                reason = sniff_dicom(item, allow_no_preamble)
+                if reason is not None:
+                    skipped_contents[reason] = skipped_contents.get(reason, 0) + 1
+                    continue
+                with open(item, "rb") as fp:
+                    img = pydicom.dcmread(
+                        fp,
+                        stop_before_pixels=True,
+                        specific_tags=organize_tags,
+                        force=allow_no_preamble,
+                    )
+                    bytes_read += fp.tell()
+                bytes_total += os.path.getsize(item)
                 seriesInstanceUID = img[0x0020000E].value
-                seriesDesc = img[0x0008103E].value or "SeriesDescription"
+                seriesDesc = img.get(0x0008103E)
+                seriesDesc = (
+                    seriesDesc.value if seriesDesc else ""
+                ) or "SeriesDescription"
                 imagename = f"{seriesDesc}-{os.path.basename(item)}"
                 foldername = f"{seriesDesc}-{seriesInstanceUID}"
                 folderpath = os.path.join(dest_dir, foldername)
 
                 if not os.path.exists(folderpath):
                     os.makedirs(folderpath)
-                shutil.copyfile(item, os.path.join(folderpath, imagename))
+                used = place_file(item, os.path.join(folderpath, imagename))
+                if used != placement_mode:
+                    fallback_count += 1
                 success_contents.append(item)
             except:
                 failed_contents.append(item)
@@ -70,7 +147,16 @@ try:
             message = (
                 message + f"Finished organizing files, see output folder: {dest_dir}"
             )
-        if len(failed_contents) == 0 and len(success_contents) == len(dcms):
+            skipped_mb = (bytes_total - bytes_read) / (1024 * 1024)
+            message = message + f"\nSkipped reading {skipped_mb:.1f} MB of pixel data"
+        if fallback_count > 0:
+            message = (
+                message
+                + f"\n{fallback_count} items were copied, {placement_mode} was not possible"
+            )
+        for reason, count in skipped_contents.items():
+            message = message + f"\nSkipped {count} items: {reason}"
+        if len(failed_contents) == 0:
             tkinter.messagebox.showinfo(title="Success", message=message)
         if len(failed_contents) > 0:
             tkinter.messagebox.showwarning(title="Error", message=message)